@@ -0,0 +1,125 @@
+import os
+import signal
+import time
+import argparse
+
+from app.utils.setup_logger import setup_logger
+from app.utils.setup_logger import logger_extra_data
+
+from bitcoin.node import BitcoinNode
+from bitcoin.block_range_engine import BlockRangeEngine, parse_and_process_block
+from graph_indexer import GraphIndexer
+
+
+# Global flag to signal shutdown
+shutdown_flag = False
+logger = setup_logger("BlockIndexer")
+
+DEFAULT_BLOCK_WINDOW = 10
+
+
+# Shutdown handler to gracefully shutdown the indexer
+def shutdown_handler(signum, frame):
+    global shutdown_flag
+    logger.info(
+        "Shutdown signal received. Waiting for current indexing to complete before shutting down."
+    )
+    shutdown_flag = True
+
+
+def apply_to_tx_out_table(node, block):
+    if node.follows_tx_out_table(block[0].block_height):
+        node.apply_block_to_tx_out_table(block[0])
+    return block
+
+
+def iter_block_windows(node, engine, start_block_height, last_block_height, block_window):
+    # lists of (Block, process_block results), block_window blocks at a time
+    if engine is not None:
+        blocks = (result for _, result in engine.iter_results(start_block_height, last_block_height))
+        # the workers never update the tx_out table, so the blocks are applied here
+        blocks = (apply_to_tx_out_table(node, block) for block in blocks)
+    else:
+        blocks = ((block, node.process_block(block)) for block in node.iter_parsed_blocks(start_block_height, last_block_height))
+
+    window = []
+    for block in blocks:
+        window.append(block)
+        if len(window) == block_window:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+# Index the blocks from the bitcoin node into the graph database, following the chain tip
+def do_indexing(_graph_indexer, _node, _engine, start_block_height, block_window):
+    global shutdown_flag
+
+    block_height = start_block_height
+    while not shutdown_flag:
+        current_block_height = _node.get_current_block_height()
+        if current_block_height is None or block_height > current_block_height:
+            time.sleep(10)
+            continue
+
+        for window in iter_block_windows(_node, _engine, block_height, current_block_height, block_window):
+            while not _graph_indexer.create_graph_focused_on_funds_flow(window):
+                logger.error(f"Failed to index blocks {window[0][0].block_height}-{window[-1][0].block_height}")
+                time.sleep(30)
+                if shutdown_flag:
+                    return
+
+            block_height = window[-1][0].block_height + 1
+            logger.info(
+                f"Success to index blocks",
+                extra=logger_extra_data(last_block_height=block_height - 1, current_block_height=current_block_height),
+            )
+            if shutdown_flag:
+                return
+
+
+# Register the shutdown handler for SIGINT and SIGTERM
+signal.signal(signal.SIGINT, shutdown_handler)
+signal.signal(signal.SIGTERM, shutdown_handler)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Index bitcoin blocks into the funds flow graph")
+    parser.add_argument("--start-block-height", type=int, default=None)
+    parser.add_argument("--block-window", type=int, default=int(os.environ.get("BITCOIN_INDEXER_BLOCK_WINDOW") or DEFAULT_BLOCK_WINDOW))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BITCOIN_INDEXER_WORKERS") or 0),
+                        help="process blocks in a block range engine with this many workers")
+    args = parser.parse_args()
+
+    graph_indexer = GraphIndexer()
+
+    logger.info("Creating indexes...")
+    graph_indexer.create_indexes()
+
+    # resume after the last indexed block; windows are written atomically
+    start_block_height = args.start_block_height
+    if start_block_height is None:
+        latest_block_height = graph_indexer.get_latest_block_number()
+        # get_latest_block_number is 0 on an empty graph, which starts at the genesis block
+        if graph_indexer.check_if_block_is_indexed(latest_block_height):
+            start_block_height = latest_block_height + 1
+        else:
+            start_block_height = 0
+
+    node = BitcoinNode()
+    # blocks from the start height on update the table as they are indexed
+    node.sync_tx_out_table(start_block_height - 1)
+    engine = BlockRangeEngine(process_block=parse_and_process_block, num_workers=args.workers, node=node).start() if args.workers else None
+
+    try:
+        do_indexing(graph_indexer, node, engine, start_block_height, args.block_window)
+    finally:
+        if engine is not None:
+            engine.close()
+        node.save_tx_out_checkpoint()
+        # Close the connections
+        graph_indexer.close()
+        logger.info("Indexer stopped")
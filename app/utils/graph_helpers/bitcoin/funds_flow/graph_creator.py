@@ -3,10 +3,8 @@ from typing import List, Optional
 from decimal import Decimal, getcontext
 
 from nodes.bitcoin.node_utils import (
-    pubkey_to_address,
-    construct_redeem_script,
-    hash_redeem_script,
-    create_p2sh_address,
+    derive_block_addresses,
+    get_script_pub_key_address,
 )
 
 
@@ -70,6 +68,8 @@ class GraphCreator:
             difficulty=block_data.get("difficulty", 0),
         )
 
+        derived_addresses = derive_block_addresses(block_data)
+
         for tx_data in block_data["tx"]:
             tx_id = tx_data["txid"]
             fee = Decimal(tx_data.get("fee", 0))
@@ -103,24 +103,11 @@ class GraphCreator:
                 n = vout_data["n"]
                 script_pub_key_asm = vout_data["scriptPubKey"].get("asm", "")
 
-                address = vout_data["scriptPubKey"].get("address", "")
+                address = get_script_pub_key_address(vout_data["scriptPubKey"], derived_addresses)
                 if not address:
-                    addresses = vout_data["scriptPubKey"].get("addresses", [])
-                    if addresses:
-                        address = addresses[0]
-                    elif "OP_CHECKSIG" in script_pub_key_asm:
-                        pubkey = script_pub_key_asm.split()[0]
-                        address = pubkey_to_address(pubkey)
-                    elif "OP_CHECKMULTISIG" in script_pub_key_asm:
-                        pubkeys = script_pub_key_asm.split()[1:-2]
-                        m = int(script_pub_key_asm.split()[0])
-                        redeem_script = construct_redeem_script(pubkeys, m)
-                        hashed_script = hash_redeem_script(redeem_script)
-                        address = create_p2sh_address(hashed_script)
-                    else:
-                        raise Exception(
-                            f"Unknown address type: {vout_data['scriptPubKey']}"
-                        )
+                    raise Exception(
+                        f"Unknown address type: {vout_data['scriptPubKey']}"
+                    )
 
                 vout = VOUT(
                     vout_id=n,
@@ -1,9 +1,279 @@
 import os
-from app.utils.setup_logger import setup_logger
+import time
+import random
+import threading
+import concurrent.futures
+from app.utils.setup_logger import setup_logger, logger_extra_data
 from neo4j import GraphDatabase
+from neo4j.exceptions import TransientError, ServiceUnavailable, SessionExpired
 
 logger = setup_logger("GraphIndexer")
 
+DEFAULT_FUNDS_FLOW_BATCH_SIZE = 10000
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MIN_BATCH_SIZE = 100
+DEFAULT_MAX_BATCH_SIZE = 20000
+DEFAULT_TARGET_STATEMENT_SECONDS = 1.0
+DEFAULT_ROWS_PER_COMMIT = 50000
+DEFAULT_WRITE_RETRIES = 5
+DEFAULT_WRITERS = 1
+RETRY_BASE_DELAY_SECONDS = 0.5
+
+TRANSIENT_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+
+# addresses are upserted once per batch, see GraphIndexer.merge_batch_addresses
+ADDRESSES_QUERY = """
+    UNWIND $rows AS address
+    MERGE (:Address {address: address})
+"""
+
+# merged on the transaction id: writes commit in chunks, so a retried write must not
+# duplicate the edges of the chunks that already committed
+TRANSACTION_EDGES_QUERY = """
+    UNWIND $rows AS tx
+    MATCH (from:Address {address: tx.from})
+    MATCH (to:Address {address: tx.to})
+    MERGE (from)-[e:Transaction {id: tx.id}]->(to)
+    SET e.user_id = tx.user_id,
+        e.wallet_id = tx.wallet_id,
+        e.exchange_id = tx.exchange_id,
+        e.counterparty_id = tx.counterparty_id,
+        e.type = tx.type,
+        e.amount = tx.amount,
+        e.currency = tx.currency,
+        e.network = tx.network,
+        e.fee = tx.fee,
+        e.price = tx.price,
+        e.status = tx.status,
+        e.hash = tx.hash,
+        e.description = tx.description,
+        e.timestamp = tx.timestamp
+"""
+
+FUNDS_FLOW_TRANSACTIONS_QUERY = """
+    UNWIND $rows AS tx
+    MERGE (t:Transaction {tx_id: tx.tx_id})
+    SET t.block_height = tx.block_height,
+        t.timestamp = tx.timestamp,
+        t.fee_satoshi = tx.fee_satoshi,
+        t.is_coinbase = tx.is_coinbase,
+        t.in_total_amount = tx.in_total_amount,
+        t.out_total_amount = tx.out_total_amount
+"""
+
+# edges are merged too, one per address and direction (amounts are summed per address),
+# so re-indexed blocks and the duplicated BIP30 coinbase txids don't add edges
+FUNDS_FLOW_INPUTS_QUERY = """
+    UNWIND $rows AS input
+    MATCH (t:Transaction {tx_id: input.tx_id})
+    MATCH (a:Address {address: input.address})
+    MERGE (a)-[s:SENT]->(t)
+    SET s.value_satoshi = input.value_satoshi
+"""
+
+FUNDS_FLOW_OUTPUTS_QUERY = """
+    UNWIND $rows AS output
+    MATCH (t:Transaction {tx_id: output.tx_id})
+    MATCH (a:Address {address: output.address})
+    MERGE (t)-[s:SENT]->(a)
+    SET s.value_satoshi = output.value_satoshi
+"""
+
+
+class AdaptiveBatchSize:
+    """
+    Rows per UNWIND statement, tuned to the observed statement latency: grows by `step`
+    rows while statements finish within `target_seconds` and halves when they take longer
+    or fail (additive increase, multiplicative decrease), within [min_size, max_size].
+    """
+
+    def __init__(self, batch_size: int = None, min_size: int = None, max_size: int = None, target_seconds: float = None, step: int = None):
+        self.min_size = min_size or int(os.environ.get("GRAPH_DB_MIN_BATCH_SIZE") or DEFAULT_MIN_BATCH_SIZE)
+        self.max_size = max_size or int(os.environ.get("GRAPH_DB_MAX_BATCH_SIZE") or DEFAULT_MAX_BATCH_SIZE)
+        self.target_seconds = target_seconds or float(os.environ.get("GRAPH_DB_TARGET_STATEMENT_SECONDS") or DEFAULT_TARGET_STATEMENT_SECONDS)
+        self.batch_size = batch_size or int(os.environ.get("GRAPH_DB_BATCH_SIZE") or DEFAULT_BATCH_SIZE)
+        self.batch_size = min(max(self.batch_size, self.min_size), self.max_size)
+        self.step = step or self.min_size
+
+    def observe(self, seconds: float):
+        if seconds > self.target_seconds:
+            self.backoff()
+        else:
+            self.batch_size = min(self.batch_size + self.step, self.max_size)
+
+    def backoff(self):
+        self.batch_size = max(self.batch_size // 2, self.min_size)
+
+
+def normalize_transaction_row(tx) -> dict:
+    # normalized user transaction -> TRANSACTION_EDGES_QUERY row
+    return {
+        "id": tx["transactionID"],
+        "user_id": tx["userID"],
+        "wallet_id": tx["walletID"],
+        "exchange_id": tx["exchangeID"],
+        "counterparty_id": tx["counterpartyID"],
+        "type": tx["transaction_type"].lower(),
+        "from": tx["source_address"],
+        "to": tx["destination_address"],
+        "amount": tx["amount"],
+        "currency": tx["currency"],
+        "network": tx["network"],
+        "fee": tx["fee"],
+        "price": tx["price"],
+        "status": tx["status"],
+        "hash": tx["transaction_hash"],
+        "description": tx["transaction_description"],
+        "timestamp": tx["timestamp"],
+    }
+
+
+def get_fee_satoshi(tx, input_amounts: dict, in_total_amount: int, out_total_amount: int):
+    if tx.fee_satoshi is not None:
+        return tx.fee_satoshi
+    if tx.is_coinbase:
+        return 0
+    # prevouts that failed to resolve count as 0 under an "unknown-<txid>" address; spent
+    # nonstandard outputs share the prefix, so their fees are left null too
+    if any(address.startswith("unknown-") for address in input_amounts):
+        return None
+    return in_total_amount - out_total_amount
+
+
+def build_funds_flow_rows(blocks):
+    """
+    Transaction rows and SENT edge rows of a window of (Block, process_block results)
+    pairs, where each result is what process_in_memory_txn_for_indexing returns.
+    Only addresses whose net amount in a transaction is nonzero get an edge.
+
+    Fees the decoder doesn't know (raw blocks) are in_total_amount - out_total_amount,
+    which netting per address leaves intact, or null if a spent output is unknown.
+    """
+    transactions = []
+    inputs = []
+    outputs = []
+    for block, results in blocks:
+        for tx, (input_amounts, output_amounts, input_addresses, output_addresses, in_total_amount, out_total_amount) in zip(block.transactions, results):
+            transactions.append({
+                "tx_id": tx.tx_id,
+                "block_height": block.block_height,
+                "timestamp": tx.timestamp,
+                "fee_satoshi": get_fee_satoshi(tx, input_amounts, in_total_amount, out_total_amount),
+                "is_coinbase": tx.is_coinbase,
+                "in_total_amount": in_total_amount,
+                "out_total_amount": out_total_amount,
+            })
+            for address in input_addresses:
+                inputs.append({"tx_id": tx.tx_id, "address": address, "value_satoshi": input_amounts[address]})
+            for address in output_addresses:
+                outputs.append({"tx_id": tx.tx_id, "address": address, "value_satoshi": output_amounts[address]})
+    return transactions, inputs, outputs
+
+
+def get_tournament_rounds(num_partitions: int):
+    """
+    Round robin pairings of partitions (circle method): every pair of distinct partitions
+    meets in exactly one round, and the pairs of a round share no partition.
+    """
+    partitions = list(range(num_partitions))
+    if len(partitions) % 2:
+        partitions.append(None)
+
+    rounds = []
+    for _ in range(len(partitions) - 1):
+        pairs = [(partitions[i], partitions[-1 - i]) for i in range(len(partitions) // 2)]
+        rounds.append([(min(a, b), max(a, b)) for a, b in pairs if a is not None and b is not None])
+        # keep the first partition in place and rotate the others
+        partitions = [partitions[0], partitions[-1]] + partitions[1:-1]
+    return rounds
+
+
+class GraphWriterPool:
+    """
+    Writes nodes and then edges through `num_workers` concurrent sessions, with work split
+    so that no two concurrent transactions touch the same node:
+
+    - node keys are hash-partitioned into 2 * num_workers partitions, and every partition's
+      nodes are upserted by one job;
+    - edges go to the bucket of their two endpoint partitions. Buckets within a partition
+      run first, then the cross-partition buckets in round robin rounds of disjoint
+      partition pairs (get_tournament_rounds), one round at a time.
+
+    Jobs commit every `rows_per_commit` rows and retry transient errors with backoff (see
+    GraphIndexer.write_in_transaction), so a failed write may be partially applied.
+    """
+
+    def __init__(self, graph_indexer, num_workers: int = None, batch_size: int = None, rows_per_commit: int = None):
+        self.graph_indexer = graph_indexer
+        self.num_workers = num_workers or int(os.environ.get("GRAPH_DB_WRITERS") or DEFAULT_WRITERS)
+        self.num_partitions = 2 * self.num_workers
+        self.batch_size = batch_size
+        self.rows_per_commit = rows_per_commit or int(os.environ.get("GRAPH_DB_ROWS_PER_COMMIT") or DEFAULT_ROWS_PER_COMMIT)
+
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+
+    def get_partition(self, key) -> int:
+        return hash(key) % self.num_partitions
+
+    def _run_job(self, writes):
+        # one session and batch size per job; sessions are not shared between threads
+        batch_sizer = AdaptiveBatchSize(self.batch_size)
+        stats = {}
+        try:
+            with self.graph_indexer.driver.session() as session:
+                for query, rows in writes:
+                    for i in range(0, len(rows), self.rows_per_commit):
+                        if not self.graph_indexer.write_in_transaction(session, [(query, rows[i : i + self.rows_per_commit], ())], batch_sizer, stats):
+                            return False
+            return True
+        finally:
+            with self._stats_lock:
+                for name, value in stats.items():
+                    self.stats[name] = self.stats.get(name, 0) + value
+
+    def _run_phase(self, executor, jobs):
+        # jobs of a phase run concurrently; the next phase starts once all of them succeeded
+        futures = [executor.submit(self._run_job, writes) for writes in jobs if writes]
+        return all(future.result() for future in futures)
+
+    def write(self, node_writes, edge_writes) -> bool:
+        """
+        node_writes: [(query, rows, key_field)], each row upserting the node named by
+        row[key_field] (the row itself when key_field is None).
+        edge_writes: [(query, rows, (key_field, key_field))], each row linking the two nodes
+        named by its key fields, which node_writes must have created.
+        """
+        node_jobs = [[] for _ in range(self.num_partitions)]
+        for query, rows, key_field in node_writes:
+            partition_rows = [[] for _ in range(self.num_partitions)]
+            for row in rows:
+                partition_rows[self.get_partition(row if key_field is None else row[key_field])].append(row)
+            for partition, job_rows in enumerate(partition_rows):
+                if job_rows:
+                    node_jobs[partition].append((query, job_rows))
+
+        edge_jobs = {}
+        for query, rows, (key_field_a, key_field_b) in edge_writes:
+            bucket_rows = {}
+            for row in rows:
+                partition_a = self.get_partition(row[key_field_a])
+                partition_b = self.get_partition(row[key_field_b])
+                bucket_rows.setdefault((min(partition_a, partition_b), max(partition_a, partition_b)), []).append(row)
+            for bucket, job_rows in bucket_rows.items():
+                edge_jobs.setdefault(bucket, []).append((query, job_rows))
+
+        phases = [node_jobs, [edge_jobs.get((partition, partition)) for partition in range(self.num_partitions)]]
+        for pairs in get_tournament_rounds(self.num_partitions):
+            phases.append([edge_jobs.get(pair) for pair in pairs])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for jobs in phases:
+                if not self._run_phase(executor, jobs):
+                    return False
+        return True
+
 
 class GraphIndexer:
     def __init__(
@@ -169,76 +439,136 @@ class GraphIndexer:
                     except Exception as e:
                         logger.error(f"An exception occurred while creating index {index_name}: {e}")
 
-    # Create a graph focused on specific data
-    def create_graph_focused_on_specific_data(self, normalized_data):
-        transactions = normalized_data["transaction"]
-        batch_step = 1
+    # Create the funds flow graph of a window of blocks
+    def create_graph_focused_on_funds_flow(self, blocks, batch_size: int = None):
+        """
+        Write (Address)-[:SENT]->(Transaction)-[:SENT]->(Address) for a window of
+        (Block, process_block results) pairs in one write transaction, see write_in_transaction.
+        """
+        batch_sizer = AdaptiveBatchSize(batch_size or int(os.environ.get("GRAPH_DB_FUNDS_FLOW_BATCH_SIZE") or DEFAULT_FUNDS_FLOW_BATCH_SIZE))
+        transactions, inputs, outputs = build_funds_flow_rows(blocks)
+        start_time = time.time()
+        stats = {}
 
         with self.driver.session() as session:
-            # Start a transaction
-            transaction = session.begin_transaction()
+            is_success = self.write_in_transaction(
+                session,
+                [
+                    (FUNDS_FLOW_TRANSACTIONS_QUERY, transactions, ()),
+                    (FUNDS_FLOW_INPUTS_QUERY, inputs, ("address",)),
+                    (FUNDS_FLOW_OUTPUTS_QUERY, outputs, ("address",)),
+                ],
+                batch_sizer,
+                stats,
+            )
+        if not is_success:
+            return False
 
+        time_taken = time.time() - start_time
+        logger.info(
+            f"Indexed blocks {blocks[0][0].block_height}-{blocks[-1][0].block_height}" if blocks else "Indexed no blocks",
+            extra=logger_extra_data(
+                transactions=len(transactions),
+                edges=len(inputs) + len(outputs),
+                time_taken=round(time_taken, 2),
+                transactions_per_second=round(len(transactions) / time_taken, 1) if time_taken > 0 else None,
+                batch_size=batch_sizer.batch_size,
+                **stats,
+            ),
+        )
+        return True
+
+    # Create a graph focused on specific data
+    def create_graph_focused_on_specific_data(self, normalized_data, batch_size: int = None, rows_per_commit: int = None):
+        """
+        Write the normalized user transactions as (Address)-[:Transaction]->(Address) edges.
+        Rows are sent in UNWIND statements sized by AdaptiveBatchSize and committed every
+        `rows_per_commit` rows; a transaction that fails with a transient error is retried.
+        Edges are merged on the transaction id, so rewriting partly written data is safe.
+        With GRAPH_DB_WRITERS > 1 the rows are written concurrently by a GraphWriterPool.
+        """
+        rows = [normalize_transaction_row(tx) for tx in normalized_data["transaction"]]
+        rows_per_commit = rows_per_commit or int(os.environ.get("GRAPH_DB_ROWS_PER_COMMIT") or DEFAULT_ROWS_PER_COMMIT)
+        batch_sizer = AdaptiveBatchSize(batch_size)
+        start_time = time.time()
+        stats = {}
+
+        num_writers = int(os.environ.get("GRAPH_DB_WRITERS") or DEFAULT_WRITERS)
+        if num_writers > 1:
+            writer_pool = GraphWriterPool(self, num_writers, batch_size, rows_per_commit)
+            addresses = list(dict.fromkeys(address for row in rows for address in (row["from"], row["to"])))
+            if not writer_pool.write([(ADDRESSES_QUERY, addresses, None)], [(TRANSACTION_EDGES_QUERY, rows, ("from", "to"))]):
+                return False
+            stats = dict(writer_pool.stats, address_merges_saved=2 * len(rows) - len(addresses))
+
+        else:
+            with self.driver.session() as session:
+                for i in range(0, len(rows), rows_per_commit):
+                    writes = [(TRANSACTION_EDGES_QUERY, rows[i : i + rows_per_commit], ("from", "to"))]
+                    if not self.write_in_transaction(session, writes, batch_sizer, stats):
+                        return False
+
+        time_taken = time.time() - start_time
+        logger.info(
+            f"Success loading transactions into graph database",
+            extra=logger_extra_data(
+                rows=len(rows),
+                time_taken=round(time_taken, 2),
+                rows_per_second=round(len(rows) / time_taken, 1) if time_taken > 0 else None,
+                batch_size=batch_sizer.batch_size,
+                writers=num_writers,
+                **stats,
+            ),
+        )
+        return True
+
+    def write_in_transaction(self, session, writes, batch_sizer, stats: dict = None):
+        """
+        Run every (query, rows, address_fields) write with $rows in batches of
+        batch_sizer.batch_size rows, all in one write transaction. When address_fields
+        are given, the batch's distinct addresses are upserted first (merge_batch_addresses)
+        and the query MATCHes them. Transient errors (conflicts, lost connections) roll
+        back and replay the transaction with exponential backoff; returns False once
+        retries are exhausted or on any other error.
+        """
+        max_retries = int(os.environ.get("GRAPH_DB_WRITE_RETRIES") or DEFAULT_WRITE_RETRIES)
+        stats = stats if stats is not None else {}
+        for attempt in range(max_retries + 1):
+            transaction = session.begin_transaction()
+            address_merges_saved = 0
             try:
-                for i in range(0, len(transactions) - 1, batch_step):
-                    tx_transactions = transactions[i : i + batch_step]
-
-                    # Normalize the transactions for Memgraph indexing
-                    tx_transactions_normalized = []
-
-                    for tx in tx_transactions:
-                        indexed_transaction = [{
-                            "id": tx["transactionID"], 
-                            "user_id": tx["userID"],
-                            "wallet_id": tx["walletID"],
-                            "exchange_id": tx["exchangeID"],
-                            "counterparty_id": tx["counterpartyID"],
-                            "type": tx["transaction_type"].lower(), 
-                            "from": tx["source_address"], 
-                            "to": tx["destination_address"],
-                            "amount": tx["amount"], 
-                            "currency": tx["currency"], 
-                            "network": tx["network"],
-                            "fee": tx["fee"],
-                            "price": tx["price"],
-                            "status": tx["status"],
-                            "hash": tx["transaction_hash"],
-                            "description": tx["transaction_description"],
-                            "timestamp": tx["timestamp"],
-                            }]
-                        
-                        tx_transactions_normalized += indexed_transaction
-                    
-                    # Create input edges/nodes (incoming/outcoming transactions)
-                    transaction.run(
-                        """
-                        UNWIND $txs AS tx
-                        MERGE (from:Address {address: tx.from})
-                        MERGE (to:Address {address: tx.to})
-                        CREATE (from)-[:Transaction { 
-                            id: tx.id,
-                            user_id: tx.user_id,
-                            wallet_id: tx.wallet_id, 
-                            exchange_id: tx.exchange_id,
-                            counterparty_id: tx.counterparty_id, 
-                            type: tx.type,
-                            amount: tx.amount, 
-                            currency: tx.currency, 
-                            network: tx.network, 
-                            fee: tx.fee, 
-                            price: tx.price, 
-                            status: tx.status, 
-                            hash: tx.hash, 
-                            description: tx.description,
-                            timestamp: tx.timestamp
-                        }]->(to)
-                        """,
-                        txs=tx_transactions_normalized
-                    )
-                    
+                for query, rows, address_fields in writes:
+                    i = 0
+                    while i < len(rows):
+                        batch = rows[i : i + batch_sizer.batch_size]
+                        statement_start_time = time.time()
+                        if address_fields:
+                            address_merges_saved += self.merge_batch_addresses(transaction, batch, address_fields)
+                        transaction.run(query, rows=batch)
+                        batch_sizer.observe(time.time() - statement_start_time)
+                        i += len(batch)
+
                 transaction.commit()
-                logger.info(f"Success loading transactions into graph database")
+                stats["commits"] = stats.get("commits", 0) + 1
+                stats["address_merges_saved"] = stats.get("address_merges_saved", 0) + address_merges_saved
                 return True
 
+            except TRANSIENT_ERRORS as e:
+                try:
+                    transaction.rollback()
+                except Exception:
+                    # the connection may be gone with the transaction
+                    pass
+                # a conflict or timeout is also a sign of batches that are too large
+                batch_sizer.backoff()
+                if attempt == max_retries:
+                    logger.error(f"An exception occurred, giving up after {max_retries} retries: {e}")
+                    return False
+                delay = RETRY_BASE_DELAY_SECONDS * 2 ** attempt * (1 + random.random())
+                logger.warning(f"Transient error, retrying transaction in {delay:.1f} seconds: {e}")
+                stats["retries"] = stats.get("retries", 0) + 1
+                time.sleep(delay)
+
             except Exception as e:
                 transaction.rollback()
                 logger.error(f"An exception occurred: {e}")
@@ -247,3 +577,10 @@ class GraphIndexer:
             finally:
                 if transaction.closed() is False:
                     transaction.close()
+
+    def merge_batch_addresses(self, transaction, batch, address_fields):
+        # upsert the distinct addresses of a batch once; returns the MERGEs saved over one per row and field
+        addresses = list(dict.fromkeys(row[field] for row in batch for field in address_fields))
+        transaction.run(ADDRESSES_QUERY, rows=addresses)
+        # not logged per batch; the total is reported with the write's summary
+        return len(batch) * len(address_fields) - len(addresses)
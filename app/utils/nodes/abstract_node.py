@@ -1,8 +1,23 @@
 from abc import ABC, abstractmethod
 
+import asyncio
 import concurrent
 
+
+def data_samples_cover_blocks(data_samples, blocks_to_check):
+    if len(data_samples) != len(blocks_to_check):
+        return False
+
+    for sample in data_samples:
+        if sample['block_height'] not in blocks_to_check:
+            return False
+    return True
+
+
 class Node(ABC):
+    # upper bound for the validation thread pool, None uses the executor default
+    validation_max_workers = None
+
     def __init__(self):
        pass
 
@@ -25,17 +40,40 @@ class Node(ABC):
         return is_valid
 
     def validate_all_data_samples(self, data_samples, blocks_to_check):
-        if len(data_samples) != len(blocks_to_check):
+        if not data_samples_cover_blocks(data_samples, blocks_to_check):
             return False
-        
-        for sample in data_samples:
-            if sample['block_height'] not in blocks_to_check:
-                return False
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.validation_max_workers) as executor:
             futures = [executor.submit(self.validate_data_sample, sample) for sample in data_samples]
 
             for future in concurrent.futures.as_completed(futures):
                 if not future.result():
                     return False
-        return True 
+        return True
+
+
+class AsyncNode(ABC):
+    @abstractmethod
+    async def get_current_block_height(self):
+        ...
+
+    @abstractmethod
+    async def get_block_by_height(self, block_height):
+        ...
+
+    @abstractmethod
+    async def create_challenge(self, start_block_height, last_block_height):
+        ...
+
+    async def validate_data_sample(self, data_sample):
+        block_data = await self.get_block_by_height(data_sample['block_height'])
+        is_valid = len(block_data["tx"]) == data_sample["transaction_count"]
+        return is_valid
+
+    async def validate_all_data_samples(self, data_samples, blocks_to_check):
+        if not data_samples_cover_blocks(data_samples, blocks_to_check):
+            return False
+
+        # concurrency is bounded by the node's own request limit
+        results = await asyncio.gather(*(self.validate_data_sample(sample) for sample in data_samples))
+        return all(results)
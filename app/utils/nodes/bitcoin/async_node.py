@@ -0,0 +1,326 @@
+import os
+import json
+import random
+import asyncio
+import decimal
+from urllib.parse import urlsplit, urlunsplit
+
+import aiohttp
+from bitcoinrpc.authproxy import JSONRPCException, EncodeDecimal
+from core.protocol import Challenge, MODEL_TYPE_FUNDS_FLOW, MODEL_TYPE_BALANCE_TRACKING
+
+from abstract_node import AsyncNode, data_samples_cover_blocks
+from node import BitcoinNode, get_shared_bitcoin_node
+from node_utils import (
+    check_if_block_is_valid_for_challenge,
+    get_challenge_response_txn_ids,
+    check_challenge_responses,
+    check_data_samples,
+    build_block_tx_out_index,
+)
+from columnar_block import parse_block_data_columnar
+from balance_deltas import compute_balance_deltas
+from rpc_pool import map_batch_responses, is_not_found_error, DEFAULT_RPC_TIMEOUT
+from block_cache import is_result_response
+from setup_logger import setup_logger
+
+
+logger = setup_logger("AsyncBitcoinNode")
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+
+class AsyncBitcoinNode(AsyncNode):
+    """
+    asyncio variant of BitcoinNode. RPC calls go through one aiohttp session and are
+    bounded by a semaphore, so many block fetches and validations can be in flight
+    from a single event loop. tx_out hash table lookups and transaction accounting
+    are shared with the synchronous BitcoinNode passed in, by default the process's
+    shared one (see get_shared_bitcoin_node), so the tx_out table is loaded only once.
+    """
+
+    def __init__(self, node_rpc_url: str = None, bitcoin_node: BitcoinNode = None, max_concurrency: int = None):
+        self.bitcoin_node = bitcoin_node or get_shared_bitcoin_node(node_rpc_url)
+        self.node_rpc_url = node_rpc_url or self.bitcoin_node.node_rpc_url
+        self.max_concurrency = max_concurrency or int(
+            os.environ.get("BITCOIN_NODE_RPC_MAX_CONCURRENCY") or DEFAULT_MAX_CONCURRENCY
+        )
+        self.rpc_batch_size = self.bitcoin_node.rpc_batch_size
+
+        url = urlsplit(self.node_rpc_url)
+        netloc = url.hostname + (f":{url.port}" if url.port else "")
+        self._url = urlunsplit((url.scheme, netloc, url.path or "/", "", ""))
+        self._auth = aiohttp.BasicAuth(url.username or "", url.password or "")
+        self._timeout = aiohttp.ClientTimeout(
+            total=int(os.environ.get("BITCOIN_NODE_RPC_TIMEOUT") or DEFAULT_RPC_TIMEOUT)
+        )
+        self._session = None
+        self._semaphore = None
+        self._request_id = 0
+
+    def _get_session(self):
+        # created lazily so that the session and semaphore belong to the running loop
+        if self._session is None or self._session.closed:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                auth=self._auth,
+                timeout=self._timeout,
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _post_raw(self, payload) -> bytes:
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.post(
+                self._url,
+                data=json.dumps(payload, default=EncodeDecimal),
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                response_data = await response.read()
+                if response.headers.get("Content-Type") != "application/json":
+                    raise JSONRPCException({
+                        'code': -342,
+                        'message': f"non-JSON HTTP response with '{response.status} {response.reason}' from server",
+                    })
+        return response_data
+
+    async def _post(self, payload):
+        return json.loads(await self._post_raw(payload), parse_float=decimal.Decimal)
+
+    async def call(self, method: str, *params):
+        self._request_id += 1
+        response = await self._post({"jsonrpc": "2.0", "method": method, "params": list(params), "id": self._request_id})
+        if response.get('error') is not None:
+            raise JSONRPCException(response['error'])
+        return response.get('result')
+
+    async def batch(self, calls: list) -> list:
+        # same contract as RpcConnectionPool.batch: (result, error) per call in request order
+        if not calls:
+            return []
+        payload = [
+            {"jsonrpc": "2.0", "method": method, "params": list(params), "id": request_id}
+            for request_id, (method, params) in enumerate(calls)
+        ]
+        return map_batch_responses(await self._post(payload), len(calls))
+
+    async def get_current_block_height(self):
+        try:
+            return await self.call("getblockcount")
+        except Exception as e:
+            logger.error(f"RPC Provider with Error: {e}")
+
+    async def get_block_verbosity(self):
+        if not self.bitcoin_node.block_verbosity_checked:
+            network_info = await self.call("getnetworkinfo")
+            self.bitcoin_node.check_block_verbosity(network_info["version"])
+        return self.bitcoin_node.block_verbosity
+
+    async def get_block_by_height(self, block_height):
+        try:
+            block_hash = await self.call("getblockhash", block_height)
+            verbosity = await self.get_block_verbosity()
+            block_cache = self.bitcoin_node.block_cache
+            if block_cache is None:
+                return await self.call("getblock", block_hash, verbosity)
+
+            # the same cache entries as BitcoinNode.fetch_block_data
+            # disk I/O and zlib on multi-MB blocks would stall the event loop
+            block_data = await asyncio.to_thread(block_cache.get, block_height, block_hash, verbosity)
+            if block_data is None:
+                self._request_id += 1
+                block_data = await self._post_raw(
+                    {"jsonrpc": "2.0", "method": "getblock", "params": [block_hash, verbosity], "id": self._request_id}
+                )
+                if is_result_response(block_data):
+                    await asyncio.to_thread(block_cache.put, block_height, block_hash, verbosity, block_data)
+            response = await asyncio.to_thread(json.loads, block_data, parse_float=decimal.Decimal)
+            if response.get('error') is not None:
+                raise JSONRPCException(response['error'])
+            return response.get('result')
+        except Exception as e:
+            logger.error(f"RPC Provider with Error: {e}")
+
+    async def get_block_headers(self, block_heights):
+        # see BitcoinNode.get_block_headers
+        headers, missing_block_heights = self.bitcoin_node.get_cached_block_headers(block_heights)
+        if not missing_block_heights:
+            return headers
+
+        try:
+            block_hashes = await self.batch([("getblockhash", (block_height,)) for block_height in missing_block_heights])
+            block_hashes = [
+                (block_height, block_hash)
+                for block_height, (block_hash, error) in zip(missing_block_heights, block_hashes)
+                if error is None
+            ]
+            responses = await self.batch([("getblockheader", (block_hash,)) for _, block_hash in block_hashes])
+        except Exception as e:
+            logger.error(f"RPC Provider with Error: {e}")
+            return headers
+
+        headers.update(self.bitcoin_node.add_block_headers([block_height for block_height, _ in block_hashes], responses))
+        return headers
+
+    async def validate_data_sample(self, data_sample):
+        return await self.validate_all_data_samples([data_sample], [data_sample['block_height']])
+
+    async def validate_all_data_samples(self, data_samples, blocks_to_check):
+        if not data_samples_cover_blocks(data_samples, blocks_to_check):
+            return False
+        headers = await self.get_block_headers([sample['block_height'] for sample in data_samples])
+        return check_data_samples(data_samples, headers)
+
+    async def get_txn_data_by_id(self, txn_id: str):
+        try:
+            return await self.call("getrawtransaction", txn_id, 1)
+        except Exception as e:
+            return None
+
+    async def get_address_and_amount_by_txn_id_and_vout_id(self, txn_id: str, vout_id: str):
+        tx_out = self.bitcoin_node.lookup_tx_out(txn_id, vout_id)
+        if tx_out is None:
+            tx_out = self.bitcoin_node.get_cached_tx_out(txn_id, vout_id)
+        if tx_out is not None:
+            return tx_out
+
+        try:
+            txn_data = await self.call("getrawtransaction", str(txn_id), 1)
+        except JSONRPCException as e:
+            # only an unknown txid is negative-cached, see BitcoinNode.get_address_and_amount_by_txn_id_and_vout_id
+            if not is_not_found_error(e):
+                raise
+            txn_data = None
+
+        prevouts = {}
+        self.bitcoin_node.add_fetched_prevouts(prevouts, txn_id, [vout_id], txn_data)
+        return prevouts[(txn_id, vout_id)]
+
+    async def resolve_prevouts(self, transactions, batch_size: int = None, local_tx_outs: dict = None):
+        # async counterpart of BitcoinNode.resolve_prevouts; batches are sent concurrently
+        return await self.fetch_missing_prevouts(
+            *await asyncio.to_thread(self.bitcoin_node.collect_prevouts, transactions, local_tx_outs), batch_size
+        )
+
+    async def resolve_columnar_prevouts(self, block, batch_size: int = None):
+        prevouts = await self.fetch_missing_prevouts(
+            *await asyncio.to_thread(
+                lambda: self.bitcoin_node.collect_prevout_keys(block.get_unresolved_prevout_keys(), block.get_tx_out_index())
+            ),
+            batch_size,
+        )
+        await asyncio.to_thread(block.set_prevouts, prevouts)
+
+    async def fetch_missing_prevouts(self, prevouts: dict, missing_vout_ids_by_txn_id: dict, batch_size: int = None):
+        batch_size = batch_size or self.rpc_batch_size
+
+        async def fetch_batch(batch_txn_ids):
+            try:
+                responses = await self.batch([("getrawtransaction", (txn_id, 1)) for txn_id in batch_txn_ids])
+            except Exception as e:
+                logger.error(f"RPC Provider with Error: {e}")
+                raise
+
+            for txn_id, (txn_data, error) in zip(batch_txn_ids, responses):
+                self.bitcoin_node.check_fetched_prevout_error(error)
+                self.bitcoin_node.add_fetched_prevouts(
+                    prevouts, txn_id, missing_vout_ids_by_txn_id[txn_id], txn_data if error is None else None
+                )
+
+        txn_ids = list(missing_vout_ids_by_txn_id)
+        await asyncio.gather(*(
+            fetch_batch(txn_ids[i : i + batch_size]) for i in range(0, len(txn_ids), batch_size)
+        ))
+        return prevouts
+
+    async def process_in_memory_txn_for_indexing(self, tx, local_tx_outs: dict = None):
+        # resolve every input up front so the synchronous accounting never blocks on RPC
+        prevouts = await self.resolve_prevouts([tx], local_tx_outs=local_tx_outs)
+        return await asyncio.to_thread(self.bitcoin_node.process_in_memory_txn_for_indexing, tx, prevouts)
+
+    async def process_block(self, block):
+        # the per-transaction accounting is CPU work, kept off the event loop like the parsing
+        block_tx_outs = await asyncio.to_thread(build_block_tx_out_index, block)
+        prevouts = await self.resolve_prevouts(block.transactions, local_tx_outs=block_tx_outs)
+        return await asyncio.to_thread(
+            lambda: [self.bitcoin_node.process_in_memory_txn_for_indexing(tx, prevouts) for tx in block.transactions]
+        )
+
+    async def create_challenge(self, start_block_height, last_block_height):
+        num_retries = 10 # to prevent infinite loop
+        is_valid_block = False
+        while num_retries and not is_valid_block:
+            block_to_check = random.randint(start_block_height, last_block_height)
+            is_valid_block = check_if_block_is_valid_for_challenge(block_to_check)
+            num_retries -= 1
+
+        # if failed ot find valid block, return invalid response
+        if not num_retries:
+            raise Exception(
+                f"Failed to create a valid challenge."
+            )
+
+        block_data = await self.get_block_by_height(block_to_check)
+        num_transactions = len(block_data["tx"])
+
+        out_total_amount = 0
+        while out_total_amount == 0:
+            selected_txn = block_data["tx"][random.randint(0, num_transactions - 1)]
+            txn_id = selected_txn.get('txid')
+
+            txn_data = await self.get_txn_data_by_id(txn_id)
+            tx = await asyncio.to_thread(self.bitcoin_node.create_in_memory_txn, txn_data)
+
+            *_, in_total_amount, out_total_amount = await self.process_in_memory_txn_for_indexing(tx)
+
+        challenge = Challenge(model_type=MODEL_TYPE_FUNDS_FLOW, in_total_amount=in_total_amount, out_total_amount=out_total_amount, tx_id_last_4_chars=txn_id[-4:])
+        return challenge, txn_id
+
+    async def validate_challenge_response_output(self, challenge: Challenge, response_output):
+        return (await self.validate_challenge_response_outputs([(challenge, response_output)]))[0]
+
+    async def validate_challenge_response_outputs(self, challenge_responses):
+        # see BitcoinNode.validate_challenge_response_outputs
+        return check_challenge_responses(
+            challenge_responses, await self.get_txn_totals(get_challenge_response_txn_ids(challenge_responses))
+        )
+
+    async def get_txn_totals(self, txn_ids, batch_size: int = None):
+        # see BitcoinNode.get_txn_totals, with the batches fetched concurrently
+        totals, missing_txn_ids = self.bitcoin_node.get_cached_txn_totals(txn_ids)
+        batch_size = batch_size or self.rpc_batch_size
+
+        async def fetch_batch(batch_txn_ids):
+            try:
+                return await self.batch([("getrawtransaction", (txn_id, 1)) for txn_id in batch_txn_ids])
+            except Exception as e:
+                logger.error(f"RPC Provider with Error: {e}")
+                return [(None, e)] * len(batch_txn_ids)
+
+        batch_responses = await asyncio.gather(*(
+            fetch_batch(missing_txn_ids[i : i + batch_size]) for i in range(0, len(missing_txn_ids), batch_size)
+        ))
+        responses = [response for responses in batch_responses for response in responses]
+
+        # decoding, address derivation and accounting run in a thread, not on the event loop
+        transactions = await asyncio.to_thread(self.bitcoin_node.create_fetched_txns, missing_txn_ids, responses)
+        prevouts = await self.resolve_prevouts(transactions, batch_size)
+        totals.update(await asyncio.to_thread(self.bitcoin_node.compute_txn_totals, transactions, prevouts))
+        return totals
+
+    async def create_balance_challenge(self, block_height):
+        block_data = await self.get_block_by_height(block_height)
+        if block_data is None:
+            raise Exception(f"Failed to fetch block: {block_height}")
+        # parsing a large block and its address derivation take hundreds of milliseconds
+        block = await asyncio.to_thread(parse_block_data_columnar, block_data, keep_scripts=False)
+        await self.resolve_columnar_prevouts(block)
+        num_changed_addresses, _ = await asyncio.to_thread(compute_balance_deltas, [block])
+
+        challenge = Challenge(model_type=MODEL_TYPE_BALANCE_TRACKING, block_height=block_height)
+        return challenge, num_changed_addresses
@@ -0,0 +1,65 @@
+import numpy as np
+
+from columnar_block import UNKNOWN_ADDRESS_ID
+
+
+def _sum_by_key(keys: np.ndarray, values: np.ndarray):
+    # (unique keys, sum of values per key) with exact int64 sums
+    if not len(keys):
+        return keys, values
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    return sorted_keys[starts], np.add.reduceat(values[order], starts)
+
+
+def compute_balance_deltas(blocks):
+    """
+    Signed per-address balance changes, in satoshi, of a range of ColumnarBlocks sharing one
+    address pool and with resolved prevouts (see BitcoinNode.resolve_columnar_prevouts).
+
+    Amounts are netted per transaction like process_in_memory_txn_for_indexing: an address
+    that both spends and receives in a transaction only changes by the difference. An
+    address counts as changed when any transaction moved a nonzero net amount for it,
+    even if its changes over the range cancel out.
+
+    Returns (number of changed addresses, {address: delta}) for the changed addresses.
+    """
+    if not blocks:
+        return 0, {}
+    address_pool = blocks[0].address_pool
+
+    tx_indexes = []
+    address_ids = []
+    amounts = []
+    tx_offset = 0
+    for block in blocks:
+        if block.address_pool is not address_pool:
+            raise Exception("Balance deltas need blocks that share one address pool")
+
+        # coinbase inputs spend nothing
+        spending = ~np.repeat(block.tx_is_coinbase, np.diff(block.tx_vin_offsets))
+        if np.any(block.vin_address_ids[spending] == UNKNOWN_ADDRESS_ID):
+            raise Exception(f"Unresolved prevouts in block {block.block_height}")
+
+        tx_indexes.append(block.get_vin_tx_indexes()[spending] + tx_offset)
+        address_ids.append(block.vin_address_ids[spending])
+        amounts.append(-block.vin_values[spending])
+
+        tx_indexes.append(block.get_vout_tx_indexes() + tx_offset)
+        address_ids.append(block.vout_address_ids)
+        amounts.append(block.vout_values)
+        tx_offset += len(block)
+
+    # net amount per (transaction, address)
+    keys = (np.concatenate(tx_indexes).astype(np.uint64) << np.uint64(32)) | np.concatenate(address_ids).astype(np.uint64)
+    keys, net_amounts = _sum_by_key(keys, np.concatenate(amounts).astype(np.int64))
+
+    changed = net_amounts != 0
+    changed_address_ids, deltas = _sum_by_key(
+        (keys[changed] & np.uint64(0xFFFFFFFF)).astype(np.uint32), net_amounts[changed]
+    )
+    delta_by_address = {
+        address_pool[address_id]: delta for address_id, delta in zip(changed_address_ids.tolist(), deltas.tolist())
+    }
+    return len(delta_by_address), delta_by_address
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import argparse
+from dataclasses import asdict
+from decimal import Decimal
+
+from rpc_pool import get_rpc_connection_pool
+from node_utils import parse_block_data
+from fast_block_decoder import decode_getblock_response
+from raw_block_parser import RawBlock, parse_raw_block
+from setup_logger import setup_logger, logger_extra_data
+
+
+logger = setup_logger("BlockDecoderBenchmark")
+
+
+def decode_default(response_data: bytes):
+    # what the default path does: Decimal floats, then parse_block_data
+    return parse_block_data(json.loads(response_data, parse_float=Decimal)["result"])
+
+
+def comparable_block(block):
+    # serialized blocks carry no fees
+    block_data = asdict(block)
+    for tx_data in block_data["transactions"]:
+        tx_data["fee_satoshi"] = 0
+    return block_data
+
+
+def benchmark_block_decoder(rpc_url: str, block_heights, rounds: int = 3):
+    """
+    Fetch verbose and serialized getblock responses and time the default, fast and raw
+    decoders on them, checking that all of them produce the same Block.
+    """
+    rpc_pool = get_rpc_connection_pool(rpc_url)
+    payloads = []
+    raw_blocks = []
+    for block_height in block_heights:
+        block_hash = rpc_pool.call("getblockhash", block_height)
+        payloads.append(rpc_pool.call_raw("getblock", block_hash, 2))
+        raw_blocks.append(RawBlock(block_height, bytes.fromhex(rpc_pool.call("getblock", block_hash, 0))))
+
+    for block_height, payload, raw_block in zip(block_heights, payloads, raw_blocks):
+        block = decode_default(payload)
+        if asdict(block) != asdict(decode_getblock_response(payload)):
+            raise Exception(f"Fast decoder disagrees on block {block_height}")
+        if comparable_block(block) != comparable_block(parse_raw_block(raw_block)):
+            raise Exception(f"Raw decoder disagrees on block {block_height}")
+
+    timings = {}
+    for name, decode, inputs in (
+        ("default", decode_default, payloads),
+        ("fast", decode_getblock_response, payloads),
+        ("raw", parse_raw_block, raw_blocks),
+    ):
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            for block_input in inputs:
+                decode(block_input)
+        timings[name] = (time.perf_counter() - start_time) / (rounds * len(inputs))
+
+    logger.info(
+        f"Decoded {len(payloads)} blocks, fast decoder is {timings['default'] / timings['fast']:.2f}x "
+        f"and raw decoder {timings['default'] / timings['raw']:.2f}x the default",
+        extra=logger_extra_data(
+            default_ms_per_block=round(timings["default"] * 1000, 2),
+            fast_ms_per_block=round(timings["fast"] * 1000, 2),
+            raw_ms_per_block=round(timings["raw"] * 1000, 2),
+            payload_mb=round(sum(len(payload) for payload in payloads) / (1024 * 1024), 1),
+            raw_payload_mb=round(sum(len(raw_block.data) for raw_block in raw_blocks) / (1024 * 1024), 1),
+        ),
+    )
+    return timings
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Compare the default, fast and raw getblock decoders")
+    parser.add_argument("--rpc-url", default=os.environ.get("BITCOIN_NODE_RPC_URL"))
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("heights", nargs="+", type=int)
+    args = parser.parse_args()
+
+    if not args.rpc_url:
+        parser.error("--rpc-url or BITCOIN_NODE_RPC_URL is required")
+
+    benchmark_block_decoder(args.rpc_url, args.heights, args.rounds)
@@ -0,0 +1,166 @@
+import os
+import re
+import zlib
+import threading
+from collections import OrderedDict
+
+from setup_logger import setup_logger, logger_extra_data
+
+
+logger = setup_logger("BlockCache")
+
+DEFAULT_MAX_SIZE_MB = 4096
+DEFAULT_COMPRESSION_LEVEL = 6
+
+_FILE_NAME = re.compile(r"^(\d+)-([0-9a-f]{64})\.(\w+)\.z$")
+# bitcoind puts "result" first (or right after "jsonrpc"); error responses have a null result
+_RESULT_RESPONSE = re.compile(rb'^\{\s*(?:"jsonrpc"\s*:\s*"2\.0"\s*,\s*)?"result"\s*:\s*[{"]')
+
+
+def is_result_response(response_data: bytes) -> bool:
+    # whether a raw getblock response carries a block rather than an error
+    return _RESULT_RESPONSE.match(response_data) is not None
+
+
+class BlockCache:
+    """
+    zlib-compressed getblock responses on disk, one file per block and format
+    ("<height>-<hash>.<format>.z"). Blocks are looked up by the hash the node reports
+    for the height, so a block reorganized out of the chain is never served, and
+    storing a block drops the other blocks cached at its height.
+
+    Files beyond `max_bytes` are evicted least recently used first (file mtimes
+    carry the order over restarts). Writes are atomic, so several processes may
+    share a directory; each one evicts what it knows of.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # file name -> size, least recently used first
+        self._files = OrderedDict()
+        self._file_names_by_height = {}
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        entries = []
+        for entry in os.scandir(directory):
+            if _FILE_NAME.match(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(entries):
+            self._add(file_name, size)
+        self._evict()
+
+        logger.info(
+            f"Opened block cache: {directory}",
+            extra=logger_extra_data(files=len(self._files), size_mb=round(self._size / (1024 * 1024), 1)),
+        )
+
+    def __len__(self):
+        return len(self._files)
+
+    @staticmethod
+    def _file_name(block_height: int, block_hash: str, block_format) -> str:
+        return f"{block_height}-{block_hash}.{block_format}.z"
+
+    def _add(self, file_name: str, size: int):
+        # callers hold the lock, or own the cache during __init__
+        self._size += size - self._files.get(file_name, 0)
+        self._files[file_name] = size
+        self._files.move_to_end(file_name)
+        block_height = int(_FILE_NAME.match(file_name).group(1))
+        self._file_names_by_height.setdefault(block_height, set()).add(file_name)
+
+    def _remove(self, file_name: str):
+        self._size -= self._files.pop(file_name, 0)
+        block_height = int(_FILE_NAME.match(file_name).group(1))
+        file_names = self._file_names_by_height.get(block_height)
+        if file_names is not None:
+            file_names.discard(file_name)
+            if not file_names:
+                del self._file_names_by_height[block_height]
+        try:
+            os.remove(os.path.join(self.directory, file_name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._files:
+            self._remove(next(iter(self._files)))
+            self.evictions += 1
+
+    def get(self, block_height: int, block_hash: str, block_format):
+        file_name = self._file_name(block_height, block_hash, block_format)
+        path = os.path.join(self.directory, file_name)
+        try:
+            with open(path, "rb") as file:
+                data = zlib.decompress(file.read())
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except zlib.error:
+            logger.warning(f"Dropping corrupt block cache file: {file_name}")
+            with self._lock:
+                self._remove(file_name)
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if file_name in self._files:
+                self._files.move_to_end(file_name)
+            else:
+                # written by another process sharing the directory
+                self._add(file_name, os.path.getsize(path) if os.path.exists(path) else 0)
+        return data
+
+    def put(self, block_height: int, block_hash: str, block_format, data: bytes):
+        file_name = self._file_name(block_height, block_hash, block_format)
+        path = os.path.join(self.directory, file_name)
+        compressed = zlib.compress(data, self.compression_level)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(compressed)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._invalidate(block_height, keep_hash=block_hash)
+            self._add(file_name, len(compressed))
+            self._evict()
+
+    def invalidate(self, block_height: int, keep_hash: str = None):
+        # drop the blocks cached at a height, except the one with keep_hash
+        with self._lock:
+            self._invalidate(block_height, keep_hash)
+
+    def _invalidate(self, block_height: int, keep_hash: str = None):
+        for file_name in list(self._file_names_by_height.get(block_height, ())):
+            if keep_hash is None or _FILE_NAME.match(file_name).group(2) != keep_hash:
+                self._remove(file_name)
+                self.invalidations += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "size_mb": round(self._size / (1024 * 1024), 1),
+                "max_size_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
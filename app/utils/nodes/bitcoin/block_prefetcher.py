@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from setup_logger import setup_logger, logger_extra_data
+
+
+logger = setup_logger("BlockPrefetcher")
+
+DEFAULT_LOOK_AHEAD = 8
+
+
+class BlockPrefetcher:
+    """
+    Walks a range of block heights while the next `look_ahead` blocks are fetched
+    (fetch_block_payload) and parsed (parse_block_payload) in the background.
+    Blocks are yielded in height order; no more than `look_ahead` blocks are ever
+    buffered, so a slow consumer throttles the RPC side. `parse_block` replaces
+    parse_block_payload, e.g. to yield the fetched payloads as they are.
+    """
+
+    def __init__(self, node, look_ahead: int = None, parse_block=None):
+        self.node = node
+        self.parse_block = parse_block or node.parse_block_payload
+        self.look_ahead = look_ahead or int(
+            os.environ.get("BITCOIN_NODE_BLOCK_PREFETCH") or DEFAULT_LOOK_AHEAD
+        )
+
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {
+                "blocks": 0,
+                "fetch_seconds": 0.0,
+                "parse_seconds": 0.0,
+                # time the consumer spent blocked on the next block
+                "wait_seconds": 0.0,
+                # time spent in the consumer between two blocks
+                "consume_seconds": 0.0,
+            }
+
+    def _add_stat(self, name, value):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _fetch_and_parse(self, block_height):
+        start_time = time.time()
+        block_payload = self.node.fetch_block_payload(block_height)
+        fetched_time = time.time()
+        self._add_stat("fetch_seconds", fetched_time - start_time)
+
+        if block_payload is None:
+            raise Exception(f"Failed to fetch block: {block_height}")
+
+        block = self.parse_block(block_payload)
+        self._add_stat("parse_seconds", time.time() - fetched_time)
+        return block
+
+    def iter_blocks(self, start_block_height: int, last_block_height: int):
+        heights = iter(range(start_block_height, last_block_height + 1))
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.look_ahead) as executor:
+            def submit_next():
+                block_height = next(heights, None)
+                if block_height is not None:
+                    pending.append(executor.submit(self._fetch_and_parse, block_height))
+
+            for _ in range(self.look_ahead):
+                submit_next()
+
+            try:
+                while pending:
+                    wait_start_time = time.time()
+                    block = pending.popleft().result()
+                    self._add_stat("wait_seconds", time.time() - wait_start_time)
+                    submit_next()
+
+                    consume_start_time = time.time()
+                    yield block
+                    self._add_stat("consume_seconds", time.time() - consume_start_time)
+                    self._add_stat("blocks", 1)
+            finally:
+                # stop prefetching if the consumer bails out early
+                for future in pending:
+                    future.cancel()
+
+        logger.info(
+            f"Prefetched blocks {start_block_height}-{last_block_height}",
+            extra=logger_extra_data(**self.get_stats()),
+        )
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["look_ahead"] = self.look_ahead
+        return stats
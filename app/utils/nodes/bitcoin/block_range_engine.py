@@ -0,0 +1,203 @@
+import os
+import copy
+import time
+import argparse
+import multiprocessing
+from collections import deque
+
+from node import BitcoinNode
+from rpc_pool import get_rpc_connection_pool, reset_rpc_connection_pools
+from setup_logger import setup_logger, logger_extra_data
+
+
+logger = setup_logger("BlockRangeEngine")
+
+DEFAULT_CHUNK_SIZE = 16
+
+# the node of the process that starts the pool, inherited by the forked workers
+_parent_node = None
+# set in every worker process by _init_worker
+_worker_node = None
+_worker_process_block = None
+
+
+def process_block_transactions(node, block_height: int):
+    # the process_in_memory_txn_for_indexing results of every transaction in the block
+    block = node.get_parsed_block_by_height(block_height)
+    if block is None:
+        raise Exception(f"Failed to fetch block: {block_height}")
+    return node.process_block(block)
+
+
+def parse_and_process_block(node, block_height: int):
+    # (Block, process_block results), e.g. for the funds flow graph indexer
+    block = node.get_parsed_block_by_height(block_height)
+    if block is None:
+        raise Exception(f"Failed to fetch block: {block_height}")
+    return block, node.process_block(block)
+
+
+def compute_block_balance_deltas(node, block_height: int):
+    # (number of changed addresses, {address: delta in satoshi}) of the block
+    return node.get_balance_deltas(block_height)
+
+
+def get_tx_out_table_size(node) -> int:
+    if node.tx_out_table is not None:
+        return len(node.tx_out_table)
+    return sum(len(shard) for shard in node.tx_out_hash_table.values())
+
+
+def _init_worker(node_rpc_url, process_block):
+    global _worker_node, _worker_process_block
+    # every worker opens its own keep-alive connections
+    reset_rpc_connection_pools()
+    if _parent_node is not None:
+        # the parent's tx_out data is shared copy-on-write instead of being loaded again
+        _worker_node = copy.copy(_parent_node)
+        _worker_node.read_only = True
+        _worker_node.rpc_pool = get_rpc_connection_pool(_worker_node.node_rpc_url)
+    else:
+        _worker_node = BitcoinNode(node_rpc_url, read_only=True)
+    _worker_process_block = process_block
+
+    if get_tx_out_table_size(_worker_node) == 0:
+        logger.error(
+            "Block range worker started with an empty tx_out table, every prevout will be fetched over RPC; "
+            "pass the loaded node to BlockRangeEngine or set BITCOIN_V2_TX_OUT_INDEX"
+        )
+
+
+def _process_block_heights(block_heights):
+    start_time = time.time()
+    results = [(block_height, _worker_process_block(_worker_node, block_height)) for block_height in block_heights]
+    return results, time.time() - start_time
+
+
+class BlockRangeEngine:
+    """
+    Processes ranges of block heights in a pool of worker processes, each with its own
+    read-only BitcoinNode (see BitcoinNode.read_only) and RPC connections.
+
+    `process_block(node, block_height)` must be a module level function so that it can be
+    sent to the workers. Ranges are split into chunks of `chunk_size` consecutive heights
+    and results are yielded in height order; at most two chunks per worker are in flight,
+    so a slow consumer throttles the workers.
+
+    Given a loaded `node`, the workers are forked from it and share its tx_out data
+    copy-on-write as it was when the pool started. That only holds for the compact
+    table (BITCOIN_V2_TX_OUT_TABLE_FORMAT=compact) or the mapped index: lookups in the
+    dict shards touch reference counts, so every worker would end up copying them,
+    and several workers are refused for a loaded dict table. Otherwise each worker maps the tx_out
+    index (BITCOIN_V2_TX_OUT_INDEX), which the OS shares between them, but never loads
+    the pickles. Workers never update the tx_out table, so prevouts created after it
+    are fetched over RPC unless the blocks have them (BITCOIN_NODE_BLOCK_VERBOSITY=3).
+    """
+
+    def __init__(self, node_rpc_url: str = None, process_block=process_block_transactions, num_workers: int = None, chunk_size: int = None, node: BitcoinNode = None):
+        self.node = node
+        self.node_rpc_url = node_rpc_url or (node.node_rpc_url if node is not None else None)
+        self.process_block = process_block
+        self.num_workers = num_workers or int(os.environ.get("BITCOIN_NODE_BLOCK_WORKERS") or 0) or os.cpu_count()
+        self.chunk_size = chunk_size or int(os.environ.get("BITCOIN_NODE_BLOCK_CHUNK_SIZE") or DEFAULT_CHUNK_SIZE)
+        self.pool = None
+
+    def start(self):
+        global _parent_node
+        if self.pool is None:
+            if (
+                self.node is not None and self.node.tx_out_table is None
+                and self.num_workers > 1 and get_tx_out_table_size(self.node)
+            ):
+                raise ValueError(
+                    "Block range workers would each copy the dict tx_out table, "
+                    "set BITCOIN_V2_TX_OUT_TABLE_FORMAT=compact or BITCOIN_V2_TX_OUT_INDEX"
+                )
+            # the node is handed over through fork rather than pickled into every worker,
+            # and stays set while the pool may replace workers
+            _parent_node = self.node
+            self.pool = multiprocessing.get_context("fork").Pool(
+                self.num_workers, initializer=_init_worker, initargs=(self.node_rpc_url, self.process_block)
+            )
+        return self
+
+    def close(self):
+        global _parent_node
+        if self.pool is not None:
+            if _parent_node is self.node:
+                _parent_node = None
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def iter_results(self, start_block_height: int, last_block_height: int):
+        """
+        Yields (block_height, result) for every block of the range, in height order.
+        """
+        self.start()
+        chunks = (
+            range(chunk_start, min(chunk_start + self.chunk_size, last_block_height + 1))
+            for chunk_start in range(start_block_height, last_block_height + 1, self.chunk_size)
+        )
+        pending = deque()
+
+        def submit_next():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(self.pool.apply_async(_process_block_heights, (list(chunk),)))
+
+        for _ in range(self.num_workers * 2):
+            submit_next()
+
+        start_time = time.time()
+        num_blocks = 0
+        worker_seconds = 0.0
+        while pending:
+            results, chunk_seconds = pending.popleft().get()
+            submit_next()
+            worker_seconds += chunk_seconds
+            for block_height, result in results:
+                num_blocks += 1
+                yield block_height, result
+
+        elapsed_seconds = time.time() - start_time
+        logger.info(
+            f"Processed blocks {start_block_height}-{last_block_height}",
+            extra=logger_extra_data(
+                blocks=num_blocks,
+                workers=self.num_workers,
+                chunk_size=self.chunk_size,
+                seconds=round(elapsed_seconds, 2),
+                blocks_per_second=round(num_blocks / elapsed_seconds, 2) if elapsed_seconds else None,
+                # how much of the pool was busy, close to 1 when the range scales with the workers
+                worker_utilization=round(worker_seconds / (elapsed_seconds * self.num_workers), 2) if elapsed_seconds else None,
+            ),
+        )
+
+    def process_range(self, start_block_height: int, last_block_height: int):
+        return [result for _, result in self.iter_results(start_block_height, last_block_height)]
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Process a range of blocks in worker processes")
+    parser.add_argument("start_block_height", type=int)
+    parser.add_argument("last_block_height", type=int)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--balance-deltas", action="store_true", help="compute balance deltas instead of indexing transactions")
+    args = parser.parse_args()
+
+    process_block = compute_block_balance_deltas if args.balance_deltas else process_block_transactions
+    node = BitcoinNode()
+    with BlockRangeEngine(process_block=process_block, num_workers=args.workers, chunk_size=args.chunk_size, node=node) as engine:
+        for _ in engine.iter_results(args.start_block_height, args.last_block_height):
+            pass
@@ -0,0 +1,47 @@
+import os
+import time
+import pickle
+import argparse
+
+from tx_out_table import CompactTxOutTable
+from setup_logger import setup_logger
+
+
+logger = setup_logger("TxOutIndexBuilder")
+
+
+def build_tx_out_index(pickle_paths, output_path: str):
+    # converts tx_out hash table pickles into a file for CompactTxOutTable.open_mapped
+    table = CompactTxOutTable(max_pending=0)
+    for pickle_path in pickle_paths:
+        logger.info(f"Loading tx_out hash table: {pickle_path}")
+        start_time = time.time()
+        with open(pickle_path, 'rb') as file:
+            hash_table = pickle.load(file)
+        table.load_hash_table(hash_table, freeze=False)
+        del hash_table
+        logger.info(f"Staged tx_out hash table: {pickle_path} in {time.time() - start_time} seconds")
+
+    start_time = time.time()
+    table.freeze()
+    table.save(output_path)
+    logger.info(f"Wrote tx_out index: {output_path} ({len(table)} entries) in {time.time() - start_time} seconds")
+    return table
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Build a memory-mappable tx_out index from hash table pickles")
+    parser.add_argument("--output", default=os.environ.get("BITCOIN_V2_TX_OUT_INDEX"), help="index file to write")
+    parser.add_argument("pickles", nargs="*", help="defaults to BITCOIN_V2_TX_OUT_HASHMAP_PICKLES")
+    args = parser.parse_args()
+
+    pickle_paths = args.pickles or [
+        path for path in (os.environ.get("BITCOIN_V2_TX_OUT_HASHMAP_PICKLES") or "").split(',') if path
+    ]
+    if not args.output or not pickle_paths:
+        parser.error("an output path and at least one pickle are required")
+
+    build_tx_out_index(pickle_paths, args.output)
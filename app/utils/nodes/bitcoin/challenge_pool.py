@@ -0,0 +1,155 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+
+from core.protocol import MODEL_TYPE_FUNDS_FLOW, MODEL_TYPE_BALANCE_TRACKING
+
+from node_utils import check_if_block_is_valid_for_challenge
+from setup_logger import setup_logger, logger_extra_data
+
+
+logger = setup_logger("ChallengePool")
+
+DEFAULT_POOL_SIZE = 32
+# pop latencies kept for the percentiles in get_stats
+LATENCY_WINDOW = 1000
+# wait before retrying after a failed challenge creation
+RETRY_DELAY_SECONDS = 5
+# random blocks tried for a balance tracking challenge before giving up
+MAX_BLOCK_ATTEMPTS = 10
+
+
+class ChallengePool:
+    """
+    Keeps up to `pool_size` ready challenges per model type, created by a background
+    thread from random blocks of each model type's (start, last) height range, so that
+    get_challenge is a queue pop. Pops on an empty pool fall back to creating the
+    challenge on the spot; pop latencies and fallbacks are reported by get_stats.
+
+    Challenges are (Challenge, expected answer) as returned by BitcoinNode.create_challenge
+    and create_balance_challenge.
+    """
+
+    def __init__(self, node, block_ranges: dict, pool_size: int = None):
+        self.node = node
+        self.block_ranges = dict(block_ranges)
+        self.pool_size = pool_size or int(os.environ.get("BITCOIN_CHALLENGE_POOL_SIZE") or DEFAULT_POOL_SIZE)
+
+        self._challenges = {model_type: deque() for model_type in self.block_ranges}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {"pops": 0, "fallbacks": 0, "created": 0, "failures": 0, "discarded": 0}
+
+    def create_challenge(self, model_type: str):
+        start_block_height, last_block_height = self.block_ranges[model_type]
+        if model_type == MODEL_TYPE_FUNDS_FLOW:
+            return self.node.create_challenge(start_block_height, last_block_height)
+        if model_type == MODEL_TYPE_BALANCE_TRACKING:
+            # bounded, a range made only of avoided blocks would spin forever
+            for _ in range(MAX_BLOCK_ATTEMPTS):
+                block_height = random.randint(start_block_height, last_block_height)
+                if check_if_block_is_valid_for_challenge(block_height):
+                    return self.node.create_balance_challenge(block_height)
+            raise Exception(f"No valid block for a balance tracking challenge in {start_block_height}-{last_block_height}")
+        raise Exception(f"Unsupported challenge model type: {model_type}")
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return self
+            self._stopped = False
+            self._thread = threading.Thread(target=self._refill, name="ChallengePoolRefill", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _next_model_type(self):
+        # the emptiest pool that is not full, None when all of them are
+        model_type = min(self._challenges, key=lambda model_type: len(self._challenges[model_type]), default=None)
+        if model_type is None or len(self._challenges[model_type]) >= self.pool_size:
+            return None
+        return model_type
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                model_type = self._next_model_type()
+                while model_type is None and not self._stopped:
+                    self._condition.wait()
+                    model_type = self._next_model_type()
+                if self._stopped:
+                    return
+                block_range = self.block_ranges[model_type]
+
+            try:
+                challenge = self.create_challenge(model_type)
+            except Exception as e:
+                logger.error(f"Failed to create {model_type} challenge: {e}")
+                with self._condition:
+                    self.stats["failures"] += 1
+                    self._condition.wait(RETRY_DELAY_SECONDS)
+                continue
+
+            with self._condition:
+                self.stats["created"] += 1
+                # the range may have moved while the challenge was being created
+                if self.block_ranges.get(model_type) == block_range:
+                    self._challenges[model_type].append(challenge)
+                else:
+                    self.stats["discarded"] += 1
+
+    def get_challenge(self, model_type: str):
+        start_time = time.perf_counter()
+        with self._condition:
+            challenges = self._challenges.get(model_type)
+            challenge = challenges.popleft() if challenges else None
+            # wake the refill thread
+            self._condition.notify_all()
+
+        if challenge is None:
+            logger.warning(f"Challenge pool for {model_type} is empty, creating the challenge on the spot")
+            challenge = self.create_challenge(model_type)
+            with self._condition:
+                self.stats["fallbacks"] += 1
+
+        with self._condition:
+            self.stats["pops"] += 1
+            self._latencies.append(time.perf_counter() - start_time)
+        return challenge
+
+    def set_block_range(self, model_type: str, start_block_height: int, last_block_height: int):
+        # e.g. when the chain tip moves; pooled challenges from the old range are dropped
+        with self._condition:
+            if self.block_ranges.get(model_type) == (start_block_height, last_block_height):
+                return
+            self.block_ranges[model_type] = (start_block_height, last_block_height)
+            self.stats["discarded"] += len(self._challenges.get(model_type, ()))
+            self._challenges[model_type] = deque()
+            self._condition.notify_all()
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self.stats)
+            stats["pool_sizes"] = {model_type: len(challenges) for model_type, challenges in self._challenges.items()}
+            latencies = sorted(self._latencies)
+
+        if latencies:
+            stats["pop_latency_ms_p50"] = round(latencies[len(latencies) // 2] * 1000, 3)
+            stats["pop_latency_ms_p99"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3)
+            stats["pop_latency_ms_max"] = round(latencies[-1] * 1000, 3)
+        return stats
+
+    def log_stats(self):
+        logger.info("Challenge pool stats", extra=logger_extra_data(**self.get_stats()))
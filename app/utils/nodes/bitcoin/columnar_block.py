@@ -0,0 +1,344 @@
+import sys
+from array import array
+
+import numpy as np
+
+from node_utils import (
+    Block, Transaction, VIN, VOUT,
+    decimal_amount_to_satoshi, derive_block_addresses, get_script_pub_key_address,
+)
+from tx_out_table import AddressPool
+
+
+# address id of an input whose spent output is not known (blocks fetched below verbosity 3)
+UNKNOWN_ADDRESS_ID = 0xFFFFFFFF
+# tx_fees entry of a transaction whose fee is not known (raw blocks), None in a Block
+UNKNOWN_FEE = -1
+
+
+class ColumnarBlock:
+    """
+    A Block stored as columns instead of Transaction/VIN/VOUT objects.
+
+    Inputs and outputs of all transactions are concatenated; the inputs of transaction
+    i are rows tx_vin_offsets[i]:tx_vin_offsets[i + 1] (same for outputs). Amounts are
+    int64 satoshis and addresses are ids into address_pool, which can be shared by many
+    blocks. Script strings are optional.
+    """
+
+    def __init__(self, block_height: int, block_hash: str, timestamp: int, previous_block_hash: str,
+                 nonce: int, difficulty, address_pool: AddressPool):
+        self.block_height = block_height
+        self.block_hash = block_hash
+        self.timestamp = timestamp
+        self.previous_block_hash = previous_block_hash
+        self.nonce = nonce
+        self.difficulty = difficulty
+        self.address_pool = address_pool
+
+        self.tx_ids = []
+        self.tx_timestamps = np.empty(0, dtype=np.int64)
+        self.tx_fees = np.empty(0, dtype=np.int64)
+        self.tx_is_coinbase = np.empty(0, dtype=np.bool_)
+        self.tx_vin_offsets = np.zeros(1, dtype=np.int64)
+        self.tx_vout_offsets = np.zeros(1, dtype=np.int64)
+
+        # spent txid of every input, 0 for coinbase inputs like VIN.tx_id
+        self.vin_tx_ids = []
+        self.vin_vout_ids = np.empty(0, dtype=np.uint32)
+        self.vin_sequences = np.empty(0, dtype=np.uint32)
+        # spent output, when known (verbosity 3 blocks or resolved prevouts)
+        self.vin_address_ids = np.empty(0, dtype=np.uint32)
+        self.vin_values = np.empty(0, dtype=np.int64)
+        self.vin_script_sigs = None
+
+        self.vout_ids = np.empty(0, dtype=np.uint32)
+        self.vout_values = np.empty(0, dtype=np.int64)
+        self.vout_address_ids = np.empty(0, dtype=np.uint32)
+        self.vout_script_pub_keys = None
+
+    def __len__(self):
+        return len(self.tx_ids)
+
+    @property
+    def num_vins(self) -> int:
+        return len(self.vin_vout_ids)
+
+    @property
+    def num_vouts(self) -> int:
+        return len(self.vout_ids)
+
+    def get_vin_tx_indexes(self) -> np.ndarray:
+        # transaction index of every input row
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.tx_vin_offsets))
+
+    def get_vout_tx_indexes(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.tx_vout_offsets))
+
+    def has_prevouts(self) -> bool:
+        # every non-coinbase input knows the output it spends
+        spending = ~np.repeat(self.tx_is_coinbase, np.diff(self.tx_vin_offsets))
+        return bool(np.all(self.vin_address_ids[spending] != UNKNOWN_ADDRESS_ID))
+
+    def get_unresolved_prevout_keys(self) -> list:
+        # (txn_id, vout_id) of the outputs spent by inputs that don't know them yet
+        return [
+            (txn_id, str(vout_id))
+            for txn_id, vout_id, address_id in zip(
+                self.vin_tx_ids, self.vin_vout_ids.tolist(), self.vin_address_ids.tolist()
+            )
+            if txn_id != 0 and address_id == UNKNOWN_ADDRESS_ID
+        ]
+
+    def get_tx_out_index(self) -> dict:
+        # build_block_tx_out_index for a ColumnarBlock
+        addresses = self.address_pool
+        vout_tx_ids = np.repeat(np.array(self.tx_ids, dtype=object), np.diff(self.tx_vout_offsets))
+        return {
+            (txn_id, str(vout_id)): (addresses[address_id], value)
+            for txn_id, vout_id, address_id, value in zip(
+                vout_tx_ids.tolist(), self.vout_ids.tolist(), self.vout_address_ids.tolist(), self.vout_values.tolist()
+            )
+        }
+
+    def set_prevouts(self, prevouts: dict):
+        """
+        Fill the spent outputs of the inputs from {(txn_id, vout_id): (address, amount)},
+        as returned by BitcoinNode.resolve_prevouts. Inputs missing from prevouts are left as they are.
+        """
+        for i, (txn_id, vout_id) in enumerate(zip(self.vin_tx_ids, self.vin_vout_ids.tolist())):
+            if txn_id == 0:
+                continue
+            prevout = prevouts.get((txn_id, str(vout_id)))
+            if prevout is not None:
+                address, amount = prevout
+                self.vin_address_ids[i] = self.address_pool.intern(address)
+                self.vin_values[i] = amount
+
+    def get_memory_usage(self) -> dict:
+        column_bytes = sum(
+            column.nbytes for column in (
+                self.tx_timestamps, self.tx_fees, self.tx_is_coinbase, self.tx_vin_offsets, self.tx_vout_offsets,
+                self.vin_vout_ids, self.vin_sequences, self.vin_address_ids, self.vin_values,
+                self.vout_ids, self.vout_values, self.vout_address_ids,
+            )
+        )
+        string_bytes = sum(
+            sys.getsizeof(strings) + sum(sys.getsizeof(string) for string in strings)
+            for strings in (self.tx_ids, self.vin_tx_ids, self.vin_script_sigs or [], self.vout_script_pub_keys or [])
+        )
+        return {"column_bytes": column_bytes, "string_bytes": string_bytes}
+
+    @classmethod
+    def from_block(cls, block: Block, address_pool: AddressPool = None, keep_scripts: bool = True):
+        builder = ColumnarBlockBuilder(address_pool, keep_scripts)
+        for tx in block.transactions:
+            for vin in tx.vins:
+                builder.add_vin(vin.tx_id, vin.vout_id, vin.sequence, vin.script_sig, vin.address, vin.value_satoshi)
+            for vout in tx.vouts:
+                builder.add_vout(vout.vout_id, vout.value_satoshi, vout.script_pub_key, vout.address)
+            fee_satoshi = UNKNOWN_FEE if tx.fee_satoshi is None else tx.fee_satoshi
+            builder.add_transaction(tx.tx_id, tx.timestamp, fee_satoshi, tx.is_coinbase)
+        return builder.build(
+            block.block_height, block.block_hash, block.timestamp, block.previous_block_hash,
+            block.nonce, block.difficulty,
+        )
+
+    def to_block(self) -> Block:
+        # blocks built without scripts convert with script_sig and script_pub_key set to None
+        addresses = self.address_pool
+        vin_script_sigs = self.vin_script_sigs or [None] * self.num_vins
+        vout_script_pub_keys = self.vout_script_pub_keys or [None] * self.num_vouts
+        vin_vout_ids = self.vin_vout_ids.tolist()
+        vin_sequences = self.vin_sequences.tolist()
+        vin_address_ids = self.vin_address_ids.tolist()
+        vin_values = self.vin_values.tolist()
+        vout_ids = self.vout_ids.tolist()
+        vout_values = self.vout_values.tolist()
+        vout_address_ids = self.vout_address_ids.tolist()
+        vin_offsets = self.tx_vin_offsets.tolist()
+        vout_offsets = self.tx_vout_offsets.tolist()
+
+        block = Block(
+            block_height=self.block_height,
+            block_hash=self.block_hash,
+            timestamp=self.timestamp,
+            previous_block_hash=self.previous_block_hash,
+            nonce=self.nonce,
+            difficulty=self.difficulty,
+        )
+        for i, (tx_id, timestamp, fee_satoshi, is_coinbase) in enumerate(zip(
+            self.tx_ids, self.tx_timestamps.tolist(), self.tx_fees.tolist(), self.tx_is_coinbase.tolist()
+        )):
+            if fee_satoshi == UNKNOWN_FEE:
+                fee_satoshi = None
+            tx = Transaction(tx_id=tx_id, block_height=self.block_height, timestamp=timestamp, fee_satoshi=fee_satoshi)
+            for j in range(vin_offsets[i], vin_offsets[i + 1]):
+                vin = VIN(
+                    tx_id=self.vin_tx_ids[j],
+                    vin_id=vin_sequences[j],
+                    vout_id=vin_vout_ids[j],
+                    script_sig=vin_script_sigs[j],
+                    sequence=vin_sequences[j],
+                )
+                if vin_address_ids[j] != UNKNOWN_ADDRESS_ID:
+                    vin.address = addresses[vin_address_ids[j]]
+                    vin.value_satoshi = vin_values[j]
+                tx.vins.append(vin)
+            for j in range(vout_offsets[i], vout_offsets[i + 1]):
+                tx.vouts.append(VOUT(
+                    vout_id=vout_ids[j],
+                    value_satoshi=vout_values[j],
+                    script_pub_key=vout_script_pub_keys[j],
+                    is_spent=False,
+                    address=addresses[vout_address_ids[j]],
+                ))
+            tx.is_coinbase = is_coinbase
+            block.transactions.append(tx)
+        return block
+
+
+class ColumnarBlockBuilder:
+    """
+    Accumulates the inputs and outputs of a transaction, then the transaction itself,
+    into growable arrays; build() turns them into a ColumnarBlock.
+    """
+
+    def __init__(self, address_pool: AddressPool = None, keep_scripts: bool = True):
+        self.address_pool = address_pool if address_pool is not None else AddressPool()
+        self.keep_scripts = keep_scripts
+
+        self.tx_ids = []
+        self.tx_timestamps = array("q")
+        self.tx_fees = array("q")
+        self.tx_is_coinbase = array("b")
+        self.tx_vin_offsets = array("q", [0])
+        self.tx_vout_offsets = array("q", [0])
+
+        self.vin_tx_ids = []
+        self.vin_vout_ids = array("I")
+        self.vin_sequences = array("I")
+        self.vin_address_ids = array("I")
+        self.vin_values = array("q")
+        self.vin_script_sigs = []
+
+        self.vout_ids = array("I")
+        self.vout_values = array("q")
+        self.vout_address_ids = array("I")
+        self.vout_script_pub_keys = []
+
+    def add_vin(self, tx_id, vout_id: int, sequence: int, script_sig: str, address: str = None, value_satoshi: int = None):
+        self.vin_tx_ids.append(tx_id)
+        self.vin_vout_ids.append(vout_id)
+        self.vin_sequences.append(sequence)
+        if value_satoshi is None:
+            self.vin_address_ids.append(UNKNOWN_ADDRESS_ID)
+            self.vin_values.append(0)
+        else:
+            self.vin_address_ids.append(self.address_pool.intern(address))
+            self.vin_values.append(value_satoshi)
+        if self.keep_scripts:
+            self.vin_script_sigs.append(script_sig)
+
+    def add_vout(self, vout_id: int, value_satoshi: int, script_pub_key: str, address: str):
+        self.vout_ids.append(vout_id)
+        self.vout_values.append(value_satoshi)
+        self.vout_address_ids.append(self.address_pool.intern(address))
+        if self.keep_scripts:
+            self.vout_script_pub_keys.append(script_pub_key)
+
+    def add_transaction(self, tx_id: str, timestamp: int, fee_satoshi: int, is_coinbase: bool):
+        # closes the transaction made of the inputs and outputs added since the previous one
+        self.tx_ids.append(tx_id)
+        self.tx_timestamps.append(timestamp)
+        self.tx_fees.append(fee_satoshi)
+        self.tx_is_coinbase.append(is_coinbase)
+        self.tx_vin_offsets.append(len(self.vin_vout_ids))
+        self.tx_vout_offsets.append(len(self.vout_ids))
+
+    def build(self, block_height: int, block_hash: str, timestamp: int, previous_block_hash: str,
+              nonce: int, difficulty) -> ColumnarBlock:
+        block = ColumnarBlock(
+            block_height, block_hash, timestamp, previous_block_hash, nonce, difficulty, self.address_pool
+        )
+        block.tx_ids = self.tx_ids
+        block.tx_timestamps = np.array(self.tx_timestamps, dtype=np.int64)
+        block.tx_fees = np.array(self.tx_fees, dtype=np.int64)
+        block.tx_is_coinbase = np.array(self.tx_is_coinbase, dtype=np.bool_)
+        block.tx_vin_offsets = np.array(self.tx_vin_offsets, dtype=np.int64)
+        block.tx_vout_offsets = np.array(self.tx_vout_offsets, dtype=np.int64)
+
+        block.vin_tx_ids = self.vin_tx_ids
+        block.vin_vout_ids = np.array(self.vin_vout_ids, dtype=np.uint32)
+        block.vin_sequences = np.array(self.vin_sequences, dtype=np.uint32)
+        block.vin_address_ids = np.array(self.vin_address_ids, dtype=np.uint32)
+        block.vin_values = np.array(self.vin_values, dtype=np.int64)
+
+        block.vout_ids = np.array(self.vout_ids, dtype=np.uint32)
+        block.vout_values = np.array(self.vout_values, dtype=np.int64)
+        block.vout_address_ids = np.array(self.vout_address_ids, dtype=np.uint32)
+
+        if self.keep_scripts:
+            block.vin_script_sigs = self.vin_script_sigs
+            block.vout_script_pub_keys = self.vout_script_pub_keys
+        return block
+
+
+def parse_block_data_columnar(block_data, address_pool: AddressPool = None, keep_scripts: bool = True,
+                              amount_to_satoshi=decimal_amount_to_satoshi) -> ColumnarBlock:
+    """
+    parse_block_data straight into a ColumnarBlock, without the intermediate dataclasses.
+    """
+    timestamp = int(block_data["time"])
+    derived_addresses = derive_block_addresses(block_data)
+    builder = ColumnarBlockBuilder(address_pool, keep_scripts)
+
+    for tx_data in block_data["tx"]:
+        tx_id = tx_data["txid"]
+        is_coinbase = False
+
+        for vin_data in tx_data["vin"]:
+            prev_tx_id = vin_data.get("txid", 0)
+            prevout = vin_data.get("prevout")
+            address = value_satoshi = None
+            if prevout is not None:
+                value_satoshi = amount_to_satoshi(prevout["value"])
+                address = (
+                    get_script_pub_key_address(prevout["scriptPubKey"], derived_addresses)
+                    or f"unknown-{prev_tx_id}"
+                )
+            builder.add_vin(
+                prev_tx_id,
+                vin_data.get("vout", 0),
+                vin_data.get("sequence", 0),
+                vin_data.get("scriptSig", {}).get("asm", ""),
+                address,
+                value_satoshi,
+            )
+            is_coinbase = "coinbase" in vin_data
+
+        for vout_data in tx_data["vout"]:
+            script_pub_key = vout_data["scriptPubKey"]
+            script_type = script_pub_key.get("type", "")
+            if "nonstandard" in script_type or script_type == "nulldata":
+                continue
+
+            address = get_script_pub_key_address(script_pub_key, derived_addresses)
+            if not address:
+                raise Exception(f"Unknown address type: {script_pub_key}")
+            builder.add_vout(
+                vout_data["n"], amount_to_satoshi(vout_data["value"]), script_pub_key.get("asm", ""), address
+            )
+
+        builder.add_transaction(
+            tx_id, int(tx_data.get("time", timestamp)), amount_to_satoshi(tx_data.get("fee", 0)), is_coinbase
+        )
+
+    return builder.build(
+        block_data["height"],
+        block_data["hash"],
+        timestamp,
+        block_data.get("previousblockhash", ""),
+        block_data.get("nonce", 0),
+        block_data.get("difficulty", 0),
+    )
@@ -0,0 +1,71 @@
+import json
+from decimal import Decimal
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+from node_utils import SATOSHI, parse_block_data
+from columnar_block import parse_block_data_columnar
+from tx_out_table import AddressPool
+
+
+def string_amount_to_satoshi(amount) -> int:
+    """
+    Exact BTC -> satoshi conversion of an amount kept as its JSON text (e.g. "0.00012345"),
+    using integer arithmetic only. Matches int(Decimal(amount) * SATOSHI).
+    """
+    if isinstance(amount, int):
+        return amount * 100000000
+
+    if len(amount) > 9 and amount[-9] == ".":
+        # bitcoind always prints exactly 8 decimals: dropping the point gives satoshis
+        try:
+            return int(amount[:-9] + amount[-8:])
+        except ValueError:
+            pass
+
+    whole, _, fraction = amount.partition(".")
+    if len(fraction) > 8 or "e" in amount or "E" in amount:
+        return int(Decimal(amount) * SATOSHI)
+
+    is_negative = whole.startswith("-")
+    satoshi = abs(int(whole or 0)) * 100000000 + int(fraction.ljust(8, "0"))
+    return -satoshi if is_negative else satoshi
+
+
+def _load_block_data(block_data: dict) -> dict:
+    # floats were kept as strings (parse_float=str); the difficulty is reported as a Decimal
+    difficulty = block_data.get("difficulty")
+    if isinstance(difficulty, str):
+        block_data["difficulty"] = Decimal(difficulty)
+    return block_data
+
+
+def _load_getblock_response(response_data: bytes) -> dict:
+    # the C JSON scanner hands every float over as its original text, so amounts
+    # are never rounded through binary floats nor converted through Decimal
+    response = json.loads(response_data, parse_float=str)
+    if response.get("error") is not None:
+        raise JSONRPCException(response["error"])
+    return _load_block_data(response["result"])
+
+
+def decode_block(block_data: dict):
+    """
+    parse_block_data for a block whose floats were kept as strings (parse_float=str).
+    Produces the same Block as the Decimal-based path.
+    """
+    return parse_block_data(_load_block_data(block_data), amount_to_satoshi=string_amount_to_satoshi)
+
+
+def decode_getblock_response(response_data: bytes):
+    """
+    Decode the raw HTTP body of a `getblock <hash> 2` JSON-RPC call into a Block.
+    """
+    return parse_block_data(_load_getblock_response(response_data), amount_to_satoshi=string_amount_to_satoshi)
+
+
+def decode_getblock_response_columnar(response_data: bytes, address_pool: AddressPool = None, keep_scripts: bool = True):
+    # decode_getblock_response into a ColumnarBlock
+    return parse_block_data_columnar(
+        _load_getblock_response(response_data), address_pool, keep_scripts, amount_to_satoshi=string_amount_to_satoshi
+    )
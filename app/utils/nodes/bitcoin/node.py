@@ -1,25 +1,41 @@
 import argparse
+import json
 import pickle
 import time
 import os
 import random
+import threading
+import concurrent.futures
 from decimal import Decimal
-from bitcoinrpc.authproxy import AuthServiceProxy
+from bitcoinrpc.authproxy import JSONRPCException
 from core.protocol import Challenge, MODEL_TYPE_FUNDS_FLOW, MODEL_TYPE_BALANCE_TRACKING
 
 
-from abstract_node import Node
+from abstract_node import Node, data_samples_cover_blocks
 from node_utils import SATOSHI, VIN, VOUT, Transaction
 from node_utils import (
-    pubkey_to_address,
-    construct_redeem_script,
-    hash_redeem_script,
-    create_p2sh_address,
+    get_script_pub_key_address,
+    get_address_and_amount_from_vout,
     check_if_block_is_valid_for_challenge,
+    get_challenge_response_txn_ids,
+    check_challenge_responses,
+    check_data_samples,
     parse_block_data, 
-    initialize_tx_out_hash_table, 
-    get_tx_out_hash_table_sub_keys
+    build_block_tx_out_index,
+    initialize_tx_out_hash_table,
 )
+from rpc_pool import get_rpc_connection_pool, is_not_found_error, DEFAULT_BATCH_SIZE
+from block_prefetcher import BlockPrefetcher
+from tx_out_table import CompactTxOutTable
+from tx_out_loader import stream_pickle_into_hash_table, load_pickles_into_compact_table
+from tx_out_checkpoint import TxOutDelta
+from bounded_cache import LRUCache, TTLCache
+from block_cache import BlockCache, DEFAULT_MAX_SIZE_MB, is_result_response
+from fast_block_decoder import decode_getblock_response, decode_getblock_response_columnar
+from raw_block_parser import RawBlock, parse_raw_block, parse_raw_block_columnar
+from columnar_block import parse_block_data_columnar
+from balance_deltas import compute_balance_deltas
+from tx_out_table import AddressPool
 from setup_logger import setup_logger
 
 
@@ -27,16 +43,41 @@ parser = argparse.ArgumentParser()
 logger = setup_logger("BitcoinNode")
  
 class BitcoinNode(Node):
-    def __init__(self, node_rpc_url: str = None):
+    def __init__(self, node_rpc_url: str = None, read_only: bool = False):
+        # read_only nodes (block range engine workers) skip the pickles and never update
+        # the tx_out table or its checkpoint; they use the mapped index if there is one
+        self.read_only = read_only
         self.tx_out_hash_table = initialize_tx_out_hash_table()
+        # "compact" keeps the tx_out entries in a CompactTxOutTable instead of the dict shards
+        self.tx_out_table = None
+        if os.environ.get("BITCOIN_V2_TX_OUT_TABLE_FORMAT") == "compact":
+            self.tx_out_table = CompactTxOutTable()
+
         pickle_files_env = os.environ.get("BITCOIN_V2_TX_OUT_HASHMAP_PICKLES")
         pickle_files = []
-        if pickle_files_env:
+        if pickle_files_env and not read_only:
             pickle_files = pickle_files_env.split(',')
 
-        for pickle_file in pickle_files:
-            if pickle_file:
-                self.load_tx_out_hash_table(pickle_file)
+        # a prebuilt index (see build_tx_out_index.py) is mapped instead of loading pickles
+        tx_out_index_path = os.environ.get("BITCOIN_V2_TX_OUT_INDEX")
+        if tx_out_index_path:
+            self.load_tx_out_index(tx_out_index_path)
+            pickle_files = []
+
+        self.load_tx_out_hash_tables(pickle_files)
+
+        # blocks applied on top of the snapshot, replayed from the last checkpoint on restart
+        self.tx_out_delta = TxOutDelta()
+        # set when a block does not extend the applied chain (reorg); the table then stops following
+        self.tx_out_table_diverged = False
+        self.tx_out_checkpoint_path = os.environ.get("BITCOIN_V2_TX_OUT_CHECKPOINT")
+        self.tx_out_checkpoint_interval = int(os.environ.get("BITCOIN_V2_TX_OUT_CHECKPOINT_INTERVAL") or 100)
+        if self.tx_out_checkpoint_path and os.path.exists(self.tx_out_checkpoint_path):
+            self.load_tx_out_checkpoint(self.tx_out_checkpoint_path)
+        elif os.environ.get("BITCOIN_V2_TX_OUT_HEIGHT"):
+            # height of the last block in the pickles / index; later blocks are applied on top
+            self.tx_out_delta.last_block_height = int(os.environ["BITCOIN_V2_TX_OUT_HEIGHT"])
+            self.tx_out_delta.last_checkpoint_block_height = self.tx_out_delta.last_block_height
                 
         if node_rpc_url is None:
             self.node_rpc_url = (
@@ -46,79 +87,489 @@ class BitcoinNode(Node):
         else:
             self.node_rpc_url = node_rpc_url
 
+        # keep-alive connections shared by every node method and validation thread
+        self.rpc_pool = get_rpc_connection_pool(self.node_rpc_url)
+        self.validation_max_workers = self.rpc_pool.pool_size
+        self.rpc_batch_size = int(os.environ.get("BITCOIN_NODE_RPC_BATCH_SIZE") or DEFAULT_BATCH_SIZE)
+
+        # "fast" decodes getblock responses from the raw bytes, see fast_block_decoder;
+        # "raw" fetches serialized blocks (verbosity 0), see raw_block_parser
+        self.block_decoder = os.environ.get("BITCOIN_NODE_BLOCK_DECODER") or "default"
+        # 3 embeds the output spent by every input (bitcoind >= 23), which saves the
+        # tx_out lookups for whole blocks; older nodes are detected and fall back to 2
+        self.block_verbosity = int(os.environ.get("BITCOIN_NODE_BLOCK_VERBOSITY") or 2)
+        self.block_verbosity_checked = self.block_verbosity < 3
+
+        # compressed getblock responses of the blocks fetched before, see block_cache
+        self.block_cache = None
+        block_cache_dir = os.environ.get("BITCOIN_NODE_BLOCK_CACHE_DIR")
+        if block_cache_dir:
+            self.block_cache = BlockCache(
+                block_cache_dir,
+                int(os.environ.get("BITCOIN_NODE_BLOCK_CACHE_SIZE_MB") or DEFAULT_MAX_SIZE_MB) * 1024 * 1024,
+            )
+
+        # getblockheader results by height, kept once they are deep enough not to be reorganized
+        self.block_header_cache = LRUCache(int(os.environ.get("BITCOIN_NODE_BLOCK_HEADER_CACHE_SIZE") or 100000))
+        self.block_header_min_confirmations = int(os.environ.get("BITCOIN_NODE_BLOCK_HEADER_MIN_CONFIRMATIONS") or 6)
+
+        # decoded vouts of transactions fetched on tx_out table misses, and txids that failed
+        self.txn_vouts_cache = LRUCache(int(os.environ.get("BITCOIN_NODE_TXN_CACHE_SIZE") or 10000))
+        self.failed_txn_cache = TTLCache(
+            int(os.environ.get("BITCOIN_NODE_FAILED_TXN_CACHE_SIZE") or 10000),
+            int(os.environ.get("BITCOIN_NODE_FAILED_TXN_CACHE_TTL") or 300),
+        )
+        # (in_total_amount, out_total_amount) of transactions named by challenge responses
+        self.txn_totals_cache = LRUCache(int(os.environ.get("BITCOIN_NODE_TXN_TOTALS_CACHE_SIZE") or 10000))
+
     def load_tx_out_hash_table(self, pickle_path: str, reset: bool = False):
         logger.info(f"Loading tx_out hash table: {pickle_path}")
-        with open(pickle_path, 'rb') as file:
-            start_time = time.time()
-            hash_table = pickle.load(file)
+        start_time = time.time()
+        if self.tx_out_table is not None:
+            with open(pickle_path, 'rb') as file:
+                hash_table = pickle.load(file)
             if reset:
-                self.tx_out_hash_table = hash_table
-            else:
-                sub_keys = get_tx_out_hash_table_sub_keys()
-                for sub_key in sub_keys:
-                    self.tx_out_hash_table[sub_key].update(hash_table[sub_key])
-            end_time = time.time()
-            logger.info(f"Successfully loaded tx_out hash table: {pickle_path} in {end_time - start_time} seconds")
+                self.tx_out_table = CompactTxOutTable()
+            self.tx_out_table.load_hash_table(hash_table)
+            logger.info(f"Compact tx_out table memory usage: {self.tx_out_table.get_memory_usage()}")
+        else:
+            if reset:
+                self.tx_out_hash_table = initialize_tx_out_hash_table()
+            stream_pickle_into_hash_table(pickle_path, self.tx_out_hash_table)
+        end_time = time.time()
+        logger.info(f"Successfully loaded tx_out hash table: {pickle_path} in {end_time - start_time} seconds")
+
+    def load_tx_out_hash_tables(self, pickle_paths):
+        pickle_paths = [pickle_path for pickle_path in pickle_paths if pickle_path]
+        if self.tx_out_table is not None and len(pickle_paths) > 1:
+            # unpickle files concurrently in worker processes
+            max_workers = int(os.environ.get("BITCOIN_V2_TX_OUT_LOAD_WORKERS") or 0) or None
+            load_pickles_into_compact_table(pickle_paths, self.tx_out_table, max_workers=max_workers)
+            return
+
+        for pickle_path in pickle_paths:
+            self.load_tx_out_hash_table(pickle_path)
+
+    def load_tx_out_index(self, index_path: str):
+        start_time = time.time()
+        self.tx_out_table = CompactTxOutTable.open_mapped(index_path)
+        end_time = time.time()
+        logger.info(f"Mapped tx_out index: {index_path} ({len(self.tx_out_table)} entries) in {end_time - start_time} seconds")
+
+    def load_tx_out_checkpoint(self, checkpoint_path: str):
+        start_time = time.time()
+        self.tx_out_delta = TxOutDelta.load(checkpoint_path)
+        for (txn_id, vout_id), (address, amount) in self.tx_out_delta.added.items():
+            self.insert_tx_out(txn_id, vout_id, address, amount)
+        for txn_id, vout_id in self.tx_out_delta.spent:
+            self.evict_tx_out(txn_id, vout_id)
+        end_time = time.time()
+        logger.info(f"Replayed tx_out checkpoint: {checkpoint_path} up to block {self.tx_out_delta.last_block_height} in {end_time - start_time} seconds")
+
+    def save_tx_out_checkpoint(self):
+        if not self.tx_out_checkpoint_path or self.tx_out_delta.last_block_height is None:
+            return
+        start_time = time.time()
+        self.tx_out_delta.save(self.tx_out_checkpoint_path)
+        end_time = time.time()
+        logger.info(f"Saved tx_out checkpoint at block {self.tx_out_delta.last_block_height} ({len(self.tx_out_delta)} changes) in {end_time - start_time} seconds")
+
+    def insert_tx_out(self, txn_id: str, vout_id: str, address: str, amount: int):
+        if self.tx_out_table is not None:
+            self.tx_out_table.add(txn_id, vout_id, address, amount)
+        else:
+            self.tx_out_hash_table[txn_id[:3]][(txn_id, vout_id)] = (address, amount)
+
+    def evict_tx_out(self, txn_id: str, vout_id: str):
+        if self.tx_out_table is not None:
+            self.tx_out_table.remove(txn_id, vout_id)
+        else:
+            self.tx_out_hash_table[txn_id[:3]].pop((txn_id, vout_id), None)
+
+    def follows_tx_out_table(self, block_height: int):
+        # whether the block is the next one to apply to the tx_out table
+        last_block_height = self.tx_out_delta.last_block_height
+        return (
+            not self.read_only and not self.tx_out_table_diverged
+            and last_block_height is not None and block_height == last_block_height + 1
+        )
+
+    def apply_block_to_tx_out_table(self, block):
+        """
+        Insert the outputs created by a parsed Block and evict the ones it spends, so
+        outputs created after the snapshot are served from the table instead of RPC.
+        Blocks are expected in height order; the delta is checkpointed every
+        BITCOIN_V2_TX_OUT_CHECKPOINT_INTERVAL blocks. A block that does not build on the
+        last applied one (a reorg) is refused and the table stops following the chain.
+        """
+        last_block_height = self.tx_out_delta.last_block_height
+        if last_block_height is not None and block.block_height <= last_block_height:
+            return
+        if last_block_height is not None and block.block_height != last_block_height + 1:
+            logger.warning(f"Applying block {block.block_height} to tx_out table after block {last_block_height}")
+        if block.block_height == (last_block_height or 0) + 1 and not self.tx_out_delta.extends_chain(block):
+            # spent snapshot entries are not kept, so the delta can't be rolled back
+            logger.error(
+                f"Block {block.block_height} ({block.block_hash}) does not extend block {last_block_height} "
+                f"({self.tx_out_delta.last_block_hash}), the chain was reorganized; the tx_out table is no longer "
+                f"updated, rebuild it or replace the checkpoint"
+            )
+            self.tx_out_table_diverged = True
+            return
+
+        created, spent = self.tx_out_delta.apply_block(block)
+        for (txn_id, vout_id), (address, amount) in created:
+            self.insert_tx_out(txn_id, vout_id, address, amount)
+        for txn_id, vout_id in spent:
+            self.evict_tx_out(txn_id, vout_id)
+
+        last_checkpoint_block_height = self.tx_out_delta.last_checkpoint_block_height or 0
+        if block.block_height - last_checkpoint_block_height >= self.tx_out_checkpoint_interval:
+            self.save_tx_out_checkpoint()
+
+    def sync_tx_out_table(self, last_block_height: int = None):
+        """
+        Catch the tx_out table up to last_block_height (the chain tip by default), resuming
+        after the snapshot (BITCOIN_V2_TX_OUT_HEIGHT) or the last checkpoint, so that
+        process_block keeps it current from the next block on.
+        Returns the height the table is at, None when the snapshot height is unknown.
+        """
+        if self.read_only:
+            return None
+        if self.tx_out_delta.last_block_height is None:
+            logger.warning("Unknown tx_out snapshot height (BITCOIN_V2_TX_OUT_HEIGHT), the tx_out table will not be updated")
+            return None
+        if last_block_height is None:
+            last_block_height = self.get_current_block_height()
+
+        start_block_height = self.tx_out_delta.last_block_height + 1
+        if last_block_height is not None and start_block_height <= last_block_height:
+            logger.info(f"Syncing tx_out table with blocks {start_block_height}-{last_block_height}")
+            for block in self.iter_parsed_blocks(start_block_height, last_block_height):
+                self.apply_block_to_tx_out_table(block)
+                if self.tx_out_table_diverged:
+                    break
+            self.save_tx_out_checkpoint()
+        return self.tx_out_delta.last_block_height
 
     def get_current_block_height(self):
-        rpc_connection = AuthServiceProxy(self.node_rpc_url)
         try:
-            return rpc_connection.getblockcount()
+            return self.rpc_pool.call("getblockcount")
         except Exception as e:
             logger.error(f"RPC Provider with Error: {e}")
-        finally:
-            rpc_connection._AuthServiceProxy__conn.close()  # Close the connection
      
 
+    def check_block_verbosity(self, version: int):
+        if version < 230000:
+            logger.warning(f"Node version {version} does not support getblock verbosity 3, using 2")
+            self.block_verbosity = 2
+        self.block_verbosity_checked = True
+
+    def get_block_verbosity(self):
+        if not self.block_verbosity_checked:
+            self.check_block_verbosity(self.rpc_pool.call("getnetworkinfo")["version"])
+        return self.block_verbosity
+
     def get_block_by_height(self, block_height):
-        rpc_connection = AuthServiceProxy(self.node_rpc_url)
         try:
-            block_hash = rpc_connection.getblockhash(block_height)
-            return rpc_connection.getblock(block_hash, 2)
+            if self.block_cache is not None:
+                response = json.loads(self.fetch_block_data(block_height, self.get_block_verbosity()), parse_float=Decimal)
+                if response.get("error") is not None:
+                    raise JSONRPCException(response["error"])
+                return response["result"]
+
+            block_hash = self.rpc_pool.call("getblockhash", block_height)
+            return self.rpc_pool.call("getblock", block_hash, self.get_block_verbosity())
         except Exception as e:
             logger.error(f"RPC Provider with Error: {e}")
-        finally:
-            rpc_connection._AuthServiceProxy__conn.close()  # Close the connection
+
+    def get_block_headers(self, block_heights):
+        """
+        {block_height: getblockheader result} for the given heights, with one batch of
+        getblockhash and one of getblockheader calls for the heights not cached yet.
+        Heights that fail to resolve are left out.
+        """
+        headers, missing_block_heights = self.get_cached_block_headers(block_heights)
+        if not missing_block_heights:
+            return headers
+
+        try:
+            block_hashes = self.rpc_pool.batch([("getblockhash", (block_height,)) for block_height in missing_block_heights])
+            block_hashes = [
+                (block_height, block_hash)
+                for block_height, (block_hash, error) in zip(missing_block_heights, block_hashes)
+                if error is None
+            ]
+            responses = self.rpc_pool.batch([("getblockheader", (block_hash,)) for _, block_hash in block_hashes])
+        except Exception as e:
+            logger.error(f"RPC Provider with Error: {e}")
+            return headers
+
+        headers.update(self.add_block_headers([block_height for block_height, _ in block_hashes], responses))
+        return headers
+
+    def get_cached_block_headers(self, block_heights):
+        # (cached headers, the distinct heights still to fetch)
+        headers = {}
+        missing_block_heights = []
+        for block_height in dict.fromkeys(block_heights):
+            header = self.block_header_cache.get(block_height)
+            if header is not None:
+                headers[block_height] = header
+            else:
+                missing_block_heights.append(block_height)
+        return headers, missing_block_heights
+
+    def add_block_headers(self, block_heights, responses):
+        # getblockheader (result, error) responses by height, caching the confirmed ones
+        headers = {}
+        for block_height, (header, error) in zip(block_heights, responses):
+            if error is not None or header is None:
+                continue
+            headers[block_height] = header
+            if header.get("confirmations", 0) >= self.block_header_min_confirmations:
+                self.block_header_cache.put(block_height, header)
+        return headers
+
+    def validate_data_sample(self, data_sample):
+        return self.validate_all_data_samples([data_sample], [data_sample['block_height']])
+
+    def validate_all_data_samples(self, data_samples, blocks_to_check):
+        # transaction counts come from the block headers instead of whole blocks
+        if not data_samples_cover_blocks(data_samples, blocks_to_check):
+            return False
+        headers = self.get_block_headers([sample['block_height'] for sample in data_samples])
+        return check_data_samples(data_samples, headers)
+
+    def fetch_block_data(self, block_height, verbosity: int):
+        # the raw getblock response (the serialized block for verbosity 0), served from
+        # the block cache while the node reports the same block hash for the height
+        block_hash = self.rpc_pool.call("getblockhash", block_height)
+        if self.block_cache is not None:
+            block_data = self.block_cache.get(block_height, block_hash, verbosity)
+            if block_data is not None:
+                return block_data
+
+        if verbosity == 0:
+            block_data = bytes.fromhex(self.rpc_pool.call("getblock", block_hash, 0))
+        else:
+            block_data = self.rpc_pool.call_raw("getblock", block_hash, verbosity)
+            if not is_result_response(block_data):
+                # error responses are raised by the decoders and never cached
+                return block_data
+
+        if self.block_cache is not None:
+            self.block_cache.put(block_height, block_hash, verbosity, block_data)
+        return block_data
+
+    def fetch_block_payload(self, block_height):
+        # raw getblock response for the fast decoder, the serialized block for the raw
+        # decoder, the verbose block dict otherwise
+        if self.block_decoder == "raw":
+            try:
+                return RawBlock(block_height, self.fetch_block_data(block_height, 0))
+            except Exception as e:
+                logger.error(f"RPC Provider with Error: {e}")
+                return None
+        if self.block_decoder == "fast":
+            try:
+                return self.fetch_block_data(block_height, self.get_block_verbosity())
+            except Exception as e:
+                logger.error(f"RPC Provider with Error: {e}")
+                return None
+        return self.get_block_by_height(block_height)
+
+    def parse_block_payload(self, block_payload):
+        if isinstance(block_payload, RawBlock):
+            return parse_raw_block(block_payload)
+        if isinstance(block_payload, bytes):
+            return decode_getblock_response(block_payload)
+        return parse_block_data(block_payload)
+
+    def get_parsed_block_by_height(self, block_height):
+        block_payload = self.fetch_block_payload(block_height)
+        if block_payload is None:
+            raise Exception(f"Failed to fetch block: {block_height}")
+        return self.parse_block_payload(block_payload)
+
+    def parse_columnar_block_payload(self, block_payload, address_pool=None, keep_scripts: bool = True):
+        # parse_block_payload into a ColumnarBlock, see columnar_block
+        if isinstance(block_payload, RawBlock):
+            return parse_raw_block_columnar(block_payload, address_pool, keep_scripts)
+        if isinstance(block_payload, bytes):
+            return decode_getblock_response_columnar(block_payload, address_pool, keep_scripts)
+        return parse_block_data_columnar(block_payload, address_pool, keep_scripts)
+
+    def get_columnar_block_by_height(self, block_height, address_pool=None, keep_scripts: bool = True):
+        block_payload = self.fetch_block_payload(block_height)
+        if block_payload is None:
+            raise Exception(f"Failed to fetch block: {block_height}")
+        return self.parse_columnar_block_payload(block_payload, address_pool, keep_scripts)
+
+    def iter_parsed_blocks(self, start_block_height: int, last_block_height: int, look_ahead: int = None):
+        # parsed Blocks in height order, with the next blocks fetched in the background
+        prefetcher = BlockPrefetcher(self, look_ahead=look_ahead)
+        return prefetcher.iter_blocks(start_block_height, last_block_height)
 
     def get_transaction_by_hash(self, tx_hash):
         logger.error(f"get_transaction_by_hash not implemented for BitcoinNode")
         raise NotImplementedError()
     
+    def lookup_tx_out(self, txn_id: str, vout_id: str):
+        if self.tx_out_table is not None:
+            return self.tx_out_table.get(txn_id, vout_id)
+
+        entry = self.tx_out_hash_table[txn_id[:3]].get((txn_id, vout_id))
+        if entry is None:
+            return None
+        address, amount = entry
+        return address, int(amount)
+
     def get_address_and_amount_by_txn_id_and_vout_id(self, txn_id: str, vout_id: str):
+        # get from hash table if exists
+        tx_out = self.lookup_tx_out(txn_id, vout_id)
+        if tx_out is not None:
+            return tx_out
+
+        # then from transactions fetched earlier
+        tx_out = self.get_cached_tx_out(txn_id, vout_id)
+        if tx_out is not None:
+            return tx_out
+
         # call rpc if not in hash table
-        if (txn_id, vout_id) not in self.tx_out_hash_table[txn_id[:3]]:
-            # logger.info(f"No entry is found in tx_out hash table: (tx_id, vout_id): ({txn_id}, {vout_id})")
-            rpc_connection = AuthServiceProxy(self.node_rpc_url)
+        # logger.info(f"No entry is found in tx_out hash table: (tx_id, vout_id): ({txn_id}, {vout_id})")
+        try:
+            txn_data = self.rpc_pool.call("getrawtransaction", str(txn_id), 1)
+        except JSONRPCException as e:
+            # only an unknown txid is negative-cached; anything else must not become a silent miss
+            if not is_not_found_error(e):
+                raise
+            txn_data = None
+
+        prevouts = {}
+        self.add_fetched_prevouts(prevouts, txn_id, [vout_id], txn_data)
+        return prevouts[(txn_id, vout_id)]
+
+    def get_cached_tx_out(self, txn_id: str, vout_id: str):
+        if self.failed_txn_cache.get(txn_id) is not None:
+            return f"unknown-{txn_id}", 0
+
+        vouts = self.txn_vouts_cache.get(txn_id)
+        if vouts is None:
+            return None
+        return vouts.get(vout_id, (f"unknown-{txn_id}", 0))
+
+    def get_cache_stats(self):
+        return {
+            "txn_vouts_cache": self.txn_vouts_cache.get_stats(),
+            "failed_txn_cache": self.failed_txn_cache.get_stats(),
+            "txn_totals_cache": self.txn_totals_cache.get_stats(),
+            "block_header_cache": self.block_header_cache.get_stats(),
+            "rpc_pool": self.rpc_pool.get_stats(),
+        }
+
+    def collect_prevouts(self, transactions, local_tx_outs: dict = None):
+        """
+        Split the inputs of the given transactions into prevouts that are already known
+        (from local_tx_outs, e.g. outputs created in the same block, or the hash table)
+        and the {txn_id: {vout_id}} that still have to be fetched from the node.
+        """
+        return self.collect_prevout_keys(
+            (
+                (vin.tx_id, str(vin.vout_id))
+                for tx in transactions
+                for vin in tx.vins
+                if vin.tx_id != 0 and vin.value_satoshi is None
+            ),
+            local_tx_outs,
+        )
+
+    def collect_prevout_keys(self, keys, local_tx_outs: dict = None):
+        # collect_prevouts for (txn_id, vout_id) keys of spent outputs
+        local_tx_outs = local_tx_outs or {}
+        prevouts = {}
+        missing_vout_ids_by_txn_id = {}
+
+        for key in keys:
+            if key in prevouts:
+                continue
+            tx_out = local_tx_outs.get(key)
+            if tx_out is None:
+                tx_out = self.lookup_tx_out(*key)
+            if tx_out is None:
+                tx_out = self.get_cached_tx_out(*key)
+            if tx_out is not None:
+                prevouts[key] = tx_out
+            else:
+                missing_vout_ids_by_txn_id.setdefault(key[0], set()).add(key[1])
+
+        return prevouts, missing_vout_ids_by_txn_id
+
+    def add_fetched_prevouts(self, prevouts: dict, txn_id: str, vout_ids, txn_data):
+        """
+        Decode every vout of a fetched transaction into the LRU cache (sibling vouts are
+        often spent by the next inputs) and add the requested ones to `prevouts`.
+        A txid the node does not know (txn_data is None) is remembered in the negative
+        cache; any other error is raised, see check_fetched_prevout_error.
+        """
+        if txn_data is None:
+            self.failed_txn_cache.put(txn_id, True)
+            vouts = {}
+        else:
+            vouts = {}
+            for vout in txn_data['vout']:
+                try:
+                    vouts[str(vout['n'])] = get_address_and_amount_from_vout(vout, txn_id)
+                except Exception as e:
+                    vouts[str(vout['n'])] = (f"unknown-{txn_id}", 0)
+            self.txn_vouts_cache.put(txn_id, vouts)
+
+        for vout_id in vout_ids:
+            prevouts[(txn_id, vout_id)] = vouts.get(vout_id, (f"unknown-{txn_id}", 0))
+
+    def check_fetched_prevout_error(self, error):
+        # transient errors (e.g. -28 warming up, a missing batch result) would otherwise be
+        # cached as unknown prevouts and silently skew the totals until the TTL expires
+        if error is not None and not is_not_found_error(error):
+            raise JSONRPCException(error)
+
+    def resolve_prevouts(self, transactions, batch_size: int = None, local_tx_outs: dict = None):
+        """
+        Resolve the (address, amount) of every input spent by the given transactions.
+        Known prevouts are served locally (see collect_prevouts); the remaining misses are
+        deduplicated by txid and fetched with batched getrawtransaction calls.
+        Returns {(txn_id, vout_id): (address, amount)} keyed like the tx_out hash table,
+        for process_in_memory_txn_for_indexing.
+        """
+        return self.fetch_missing_prevouts(*self.collect_prevouts(transactions, local_tx_outs), batch_size)
+
+    def resolve_columnar_prevouts(self, block, batch_size: int = None):
+        # resolve_prevouts for the inputs of a ColumnarBlock that don't know their spent output yet
+        prevouts = self.fetch_missing_prevouts(
+            *self.collect_prevout_keys(block.get_unresolved_prevout_keys(), block.get_tx_out_index()), batch_size
+        )
+        block.set_prevouts(prevouts)
+
+    def fetch_missing_prevouts(self, prevouts: dict, missing_vout_ids_by_txn_id: dict, batch_size: int = None):
+        # completes prevouts with batched getrawtransaction calls, see collect_prevouts
+        batch_size = batch_size or self.rpc_batch_size
+
+        txn_ids = list(missing_vout_ids_by_txn_id)
+        for i in range(0, len(txn_ids), batch_size):
+            batch_txn_ids = txn_ids[i : i + batch_size]
             try:
-                txn_data = rpc_connection.getrawtransaction(str(txn_id), 1)
-                vout = next((x for x in txn_data['vout'] if str(x['n']) == vout_id), None)
-                amount = int(vout['value'] * 100000000)
-                address = vout["scriptPubKey"].get("address", "")
-                script_pub_key_asm = vout["scriptPubKey"].get("asm", "")
-                if not address:
-                    addresses = vout["scriptPubKey"].get("addresses", [])
-                    if addresses:
-                        address = addresses[0]
-                    elif "OP_CHECKSIG" in script_pub_key_asm:
-                        pubkey = script_pub_key_asm.split()[0]
-                        address = pubkey_to_address(pubkey)
-                    elif "OP_CHECKMULTISIG" in script_pub_key_asm:
-                        pubkeys = script_pub_key_asm.split()[1:-2]
-                        m = int(script_pub_key_asm.split()[0])
-                        redeem_script = construct_redeem_script(pubkeys, m)
-                        hashed_script = hash_redeem_script(redeem_script)
-                        address = create_p2sh_address(hashed_script)
-                    else:
-                        address = f"unknown-{txn_id}"
-                return address, amount
+                responses = self.rpc_pool.batch([("getrawtransaction", (txn_id, 1)) for txn_id in batch_txn_ids])
             except Exception as e:
-                address = f"unknown-{txn_id}"
-                return address, 0
-            finally:
-                rpc_connection._AuthServiceProxy__conn.close()  # Close the connection
-        else: # get from hash table if exists
-            address, amount = self.tx_out_hash_table[txn_id[:3]][(txn_id, vout_id)]
-            return address, int(amount)
+                logger.error(f"RPC Provider with Error: {e}")
+                raise
+
+            for txn_id, (txn_data, error) in zip(batch_txn_ids, responses):
+                self.check_fetched_prevout_error(error)
+                self.add_fetched_prevouts(
+                    prevouts, txn_id, missing_vout_ids_by_txn_id[txn_id], txn_data if error is None else None
+                )
+
+        return prevouts
 
     def create_challenge(self, start_block_height, last_block_height):
         num_retries = 10 # to prevent infinite loop
@@ -151,48 +602,130 @@ class BitcoinNode(Node):
         return challenge, txn_id
 
     def validate_challenge_response_output(self, challenge: Challenge, response_output):
-        if response_output[-4:] != challenge.tx_id_last_4_chars:
-            return False
-        
-        txn_data = self.get_txn_data_by_id(response_output)
-        if txn_data is None:
-            return False
-        
-        tx = self.create_in_memory_txn(txn_data)
+        return self.validate_challenge_response_outputs([(challenge, response_output)])[0]
 
-        *_, in_total_amount, out_total_amount = self.process_in_memory_txn_for_indexing(tx)
-        return challenge.in_total_amount == in_total_amount and challenge.out_total_amount == out_total_amount
-    
-    def create_balance_challenge(self, block_height):
-        block = self.get_block_by_height(block_height)
-        block_data = parse_block_data(block)
-        transactions = block_data.transactions
-        
-        balance_changes_by_address = {}
-        changed_addresses = []
-        
+    def validate_challenge_response_outputs(self, challenge_responses):
+        """
+        Validate many (Challenge, response_output) pairs at once: every txid is fetched
+        and processed once, however many responses name it, see get_txn_totals.
+        Returns one verdict per pair.
+        """
+        return check_challenge_responses(
+            challenge_responses, self.get_txn_totals(get_challenge_response_txn_ids(challenge_responses))
+        )
+
+    def get_txn_totals(self, txn_ids, batch_size: int = None):
+        """
+        {txn_id: (in_total_amount, out_total_amount)} of the given transactions, as computed
+        by process_in_memory_txn_for_indexing. Unknown txids are fetched with batched
+        getrawtransaction calls spread over the validation threads, and their prevouts
+        resolved together. Transactions that could not be fetched are left out.
+        """
+        totals, missing_txn_ids = self.get_cached_txn_totals(txn_ids)
+        batch_size = batch_size or self.rpc_batch_size
+
+        def fetch_batch(batch_txn_ids):
+            try:
+                return self.rpc_pool.batch([("getrawtransaction", (txn_id, 1)) for txn_id in batch_txn_ids])
+            except Exception as e:
+                logger.error(f"RPC Provider with Error: {e}")
+                return [(None, e)] * len(batch_txn_ids)
+
+        batches = [missing_txn_ids[i : i + batch_size] for i in range(0, len(missing_txn_ids), batch_size)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.validation_max_workers) as executor:
+            responses = [response for batch_responses in executor.map(fetch_batch, batches) for response in batch_responses]
+
+        transactions = self.create_fetched_txns(missing_txn_ids, responses)
+        totals.update(self.compute_txn_totals(transactions, self.resolve_prevouts(transactions, batch_size)))
+        return totals
+
+    def get_cached_txn_totals(self, txn_ids):
+        # (memoized totals, the distinct txids still to compute)
+        totals = {}
+        missing_txn_ids = []
+        for txn_id in dict.fromkeys(txn_ids):
+            txn_totals = self.txn_totals_cache.get(txn_id)
+            if txn_totals is not None:
+                totals[txn_id] = txn_totals
+            else:
+                missing_txn_ids.append(txn_id)
+        return totals, missing_txn_ids
+
+    def create_fetched_txns(self, txn_ids, responses):
+        # in-memory transactions of batched getrawtransaction (result, error) responses
+        transactions = []
+        for txn_id, (txn_data, error) in zip(txn_ids, responses):
+            if error is not None or txn_data is None:
+                continue
+            try:
+                transactions.append(self.create_in_memory_txn(txn_data))
+            except Exception as e:
+                logger.error(f"Failed to decode transaction {txn_id}: {e}")
+        return transactions
+
+    def compute_txn_totals(self, transactions, prevouts: dict):
+        totals = {}
         for tx in transactions:
-            in_amount_by_address, out_amount_by_address, input_addresses, output_addresses, in_total_amount, out_total_amount = self.process_in_memory_txn_for_indexing(tx)
-            
-            for address in input_addresses:
-                if not address in balance_changes_by_address:
-                    balance_changes_by_address[address] = 0
-                    changed_addresses.append(address)
-                balance_changes_by_address[address] -= in_amount_by_address[address]
-            
-            for address in output_addresses:
-                if not address in balance_changes_by_address:
-                    balance_changes_by_address[address] = 0
-                    changed_addresses.append(address)
-                balance_changes_by_address[address] += out_amount_by_address[address]
-                
+            *_, in_total_amount, out_total_amount = self.process_in_memory_txn_for_indexing(tx, prevouts)
+            totals[tx.tx_id] = (in_total_amount, out_total_amount)
+            # totals over a prevout that failed to fetch may be wrong, so they are not kept
+            if not any(vin.tx_id != 0 and self.failed_txn_cache.get(vin.tx_id) is not None for vin in tx.vins):
+                self.txn_totals_cache.put(tx.tx_id, totals[tx.tx_id])
+        return totals
+
+    def process_block(self, block):
+        """
+        Run process_in_memory_txn_for_indexing over every transaction of a parsed Block.
+        Inputs spending outputs of the same block are resolved from the block itself
+        before touching the tx_out hash table or RPC. Returns one result per transaction.
+        """
+        block_tx_outs = build_block_tx_out_index(block)
+        prevouts = self.resolve_prevouts(block.transactions, local_tx_outs=block_tx_outs)
+        results = [self.process_in_memory_txn_for_indexing(tx, prevouts) for tx in block.transactions]
+
+        # keep the tx_out table current while blocks are processed in chain order
+        if self.follows_tx_out_table(block.block_height):
+            self.apply_block_to_tx_out_table(block)
+        return results
+
+    def get_balance_deltas(self, start_block_height: int, last_block_height: int = None):
+        """
+        Per-address balance changes over a range of blocks, see compute_balance_deltas.
+        Returns (number of changed addresses, {address: delta in satoshi}).
+        """
+        if last_block_height is None:
+            last_block_height = start_block_height
+
+        if start_block_height == last_block_height:
+            block_payloads = [self.fetch_block_payload(start_block_height)]
+        else:
+            # payloads are parsed here rather than in the prefetch threads, which would share the address pool
+            prefetcher = BlockPrefetcher(self, parse_block=lambda block_payload: block_payload)
+            block_payloads = prefetcher.iter_blocks(start_block_height, last_block_height)
+
+        address_pool = AddressPool()
+        blocks = []
+        for block_height, block_payload in zip(range(start_block_height, last_block_height + 1), block_payloads):
+            if block_payload is None:
+                raise Exception(f"Failed to fetch block: {block_height}")
+            block = self.parse_columnar_block_payload(block_payload, address_pool, keep_scripts=False)
+            self.resolve_columnar_prevouts(block)
+            blocks.append(block)
+
+            # keep the tx_out table current while blocks are processed in chain order, like process_block
+            if self.follows_tx_out_table(block.block_height):
+                self.apply_block_to_tx_out_table(block.to_block())
+
+        return compute_balance_deltas(blocks)
+
+    def create_balance_challenge(self, block_height):
+        num_changed_addresses, _ = self.get_balance_deltas(block_height)
         challenge = Challenge(model_type=MODEL_TYPE_BALANCE_TRACKING, block_height=block_height)
-        return challenge, len(changed_addresses)
+        return challenge, num_changed_addresses
 
     def get_txn_data_by_id(self, txn_id: str):
         try:
-            rpc_connection = AuthServiceProxy(self.node_rpc_url)
-            return rpc_connection.getrawtransaction(txn_id, 1)
+            return self.rpc_pool.call("getrawtransaction", txn_id, 1)
         except Exception as e:
             return None
 
@@ -224,24 +757,11 @@ class BitcoinNode(Node):
             n = vout_data["n"]
             script_pub_key_asm = vout_data["scriptPubKey"].get("asm", "")
 
-            address = vout_data["scriptPubKey"].get("address", "")
+            address = get_script_pub_key_address(vout_data["scriptPubKey"])
             if not address:
-                addresses = vout_data["scriptPubKey"].get("addresses", [])
-                if addresses:
-                    address = addresses[0]
-                elif "OP_CHECKSIG" in script_pub_key_asm:
-                    pubkey = script_pub_key_asm.split()[0]
-                    address = pubkey_to_address(pubkey)
-                elif "OP_CHECKMULTISIG" in script_pub_key_asm:
-                    pubkeys = script_pub_key_asm.split()[1:-2]
-                    m = int(script_pub_key_asm.split()[0])
-                    redeem_script = construct_redeem_script(pubkeys, m)
-                    hashed_script = hash_redeem_script(redeem_script)
-                    address = create_p2sh_address(hashed_script)
-                else:
-                    raise Exception(
-                        f"Unknown address type: {vout_data['scriptPubKey']}"
-                    )
+                raise Exception(
+                    f"Unknown address type: {vout_data['scriptPubKey']}"
+                )
 
             vout = VOUT(
                 vout_id=n,
@@ -254,14 +774,23 @@ class BitcoinNode(Node):
             
         return tx
     
-    def process_in_memory_txn_for_indexing(self, tx):
+    def process_in_memory_txn_for_indexing(self, tx, prevouts=None):
         input_amounts = {} # input amounts by address in satoshi
         output_amounts = {} # output amounts by address in satoshi
 
         for vin in tx.vins:
             if vin.tx_id == 0:
                 continue
-            address, amount = self.get_address_and_amount_by_txn_id_and_vout_id(vin.tx_id, str(vin.vout_id))
+            if vin.value_satoshi is not None:
+                # spent output embedded in a verbosity 3 block
+                input_amounts[vin.address] = input_amounts.get(vin.address, 0) + vin.value_satoshi
+                continue
+            # prevouts resolved ahead of time for a whole block, see resolve_prevouts
+            prevout = prevouts.get((vin.tx_id, str(vin.vout_id))) if prevouts else None
+            if prevout is not None:
+                address, amount = prevout
+            else:
+                address, amount = self.get_address_and_amount_by_txn_id_and_vout_id(vin.tx_id, str(vin.vout_id))
             input_amounts[address] = input_amounts.get(address, 0) + amount
 
         for vout in tx.vouts:
@@ -290,3 +819,18 @@ class BitcoinNode(Node):
         out_total_amount = sum(output_amounts.values())
 
         return input_amounts, output_amounts, input_addresses, output_addresses, in_total_amount, out_total_amount
+
+
+# one BitcoinNode per rpc url, so the sync and async nodes of a process share a single
+# tx_out table instead of loading the pickles once each
+_shared_nodes = {}
+_shared_nodes_lock = threading.Lock()
+
+
+def get_shared_bitcoin_node(node_rpc_url: str = None) -> BitcoinNode:
+    with _shared_nodes_lock:
+        node = _shared_nodes.get(node_rpc_url)
+        if node is None:
+            node = BitcoinNode(node_rpc_url)
+            _shared_nodes[node_rpc_url] = node
+        return node
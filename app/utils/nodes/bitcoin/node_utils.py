@@ -1,6 +1,8 @@
+import os
 from Crypto.Hash import SHA256, RIPEMD160
 import base58
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import List, Optional
 from decimal import Decimal, getcontext
 
@@ -45,6 +47,70 @@ def create_p2sh_address(hashed_script, mainnet=True):
     return base58.b58encode(payload + checksum).decode()
 
 
+# early blocks pay to the same P2PK pubkeys over and over, so derivations are memoized
+@lru_cache(maxsize=int(os.environ.get("BITCOIN_ADDRESS_CACHE_SIZE") or 100000))
+def derive_address_from_script_pub_key_asm(script_pub_key_asm: str) -> Optional[str]:
+    # address of a P2PK or bare multisig output, which bitcoind doesn't report; None otherwise
+    if "OP_CHECKSIG" in script_pub_key_asm:
+        pubkey = script_pub_key_asm.split()[0]
+        return pubkey_to_address(pubkey)
+    elif "OP_CHECKMULTISIG" in script_pub_key_asm:
+        pubkeys = script_pub_key_asm.split()[1:-2]
+        m = int(script_pub_key_asm.split()[0])
+        redeem_script = construct_redeem_script(pubkeys, m)
+        hashed_script = hash_redeem_script(redeem_script)
+        return create_p2sh_address(hashed_script)
+    return None
+
+
+def derive_addresses(script_pub_key_asms) -> dict:
+    # each distinct script is derived once
+    return {asm: derive_address_from_script_pub_key_asm(asm) for asm in set(script_pub_key_asms)}
+
+
+def derive_block_addresses(block_data) -> dict:
+    # derivations for every output (and prevout) of a verbose block that carries no address
+    script_pub_key_asms = set()
+    for tx_data in block_data["tx"]:
+        script_pub_keys = [vout_data["scriptPubKey"] for vout_data in tx_data["vout"]]
+        # inputs of a verbosity 3 block also carry the script of the output they spend
+        script_pub_keys.extend(
+            vin_data["prevout"]["scriptPubKey"] for vin_data in tx_data["vin"] if "prevout" in vin_data
+        )
+        for script_pub_key in script_pub_keys:
+            script_type = script_pub_key.get("type", "")
+            if "nonstandard" in script_type or script_type == "nulldata":
+                continue
+            if script_pub_key.get("address") or script_pub_key.get("addresses"):
+                continue
+            script_pub_key_asms.add(script_pub_key.get("asm", ""))
+    return derive_addresses(script_pub_key_asms)
+
+
+def get_script_pub_key_address(script_pub_key: dict, derived_addresses: dict = None) -> Optional[str]:
+    address = script_pub_key.get("address", "")
+    if address:
+        return address
+    addresses = script_pub_key.get("addresses", [])
+    if addresses:
+        return addresses[0]
+
+    script_pub_key_asm = script_pub_key.get("asm", "")
+    if derived_addresses is not None and script_pub_key_asm in derived_addresses:
+        return derived_addresses[script_pub_key_asm]
+    return derive_address_from_script_pub_key_asm(script_pub_key_asm)
+
+
+def get_address_and_amount_from_vout(vout_data, txn_id: str):
+    # decodes a getrawtransaction vout the same way the tx_out hash table entries are built
+    if vout_data is None:
+        return f"unknown-{txn_id}", 0
+
+    amount = int(vout_data['value'] * 100000000)
+    address = get_script_pub_key_address(vout_data["scriptPubKey"]) or f"unknown-{txn_id}"
+    return address, amount
+
+
 def get_tx_out_hash_table_sub_keys():
     hex_chars = "0123456789abcdef"
     return [h1 + h2 + h3 for h1 in hex_chars for h2 in hex_chars for h3 in hex_chars]
@@ -57,11 +123,55 @@ def initialize_tx_out_hash_table():
     return hash_table
 
 
+def build_block_tx_out_index(block) -> dict:
+    # outputs created in the block keyed like the tx_out hash table, so that inputs
+    # spending an earlier transaction of the same block are resolved locally
+    tx_out_index = {}
+    for tx in block.transactions:
+        for vout in tx.vouts:
+            tx_out_index[(tx.tx_id, str(vout.vout_id))] = (vout.address, vout.value_satoshi)
+    return tx_out_index
+
+
 def check_if_block_is_valid_for_challenge(block_height: int) -> bool:
     blocks_to_avoid = [91722, 91880]
     return not block_height in blocks_to_avoid
 
 
+def check_data_samples(data_samples, block_headers: dict) -> bool:
+    # every sample's transaction_count against the nTx of {block_height: getblockheader result}
+    for sample in data_samples:
+        header = block_headers.get(sample['block_height'])
+        if header is None or header["nTx"] != sample["transaction_count"]:
+            return False
+    return True
+
+
+def response_matches_challenge(challenge, response_output) -> bool:
+    return isinstance(response_output, str) and response_output[-4:] == challenge.tx_id_last_4_chars
+
+
+def get_challenge_response_txn_ids(challenge_responses) -> list:
+    # distinct txids of the responses worth fetching
+    return list(dict.fromkeys(
+        response_output
+        for challenge, response_output in challenge_responses
+        if response_matches_challenge(challenge, response_output)
+    ))
+
+
+def check_challenge_responses(challenge_responses, txn_totals: dict) -> list:
+    # verdict per (Challenge, response_output) given {txn_id: (in_total_amount, out_total_amount)}
+    verdicts = []
+    for challenge, response_output in challenge_responses:
+        txn_totals_of_response = txn_totals.get(response_output) if response_matches_challenge(challenge, response_output) else None
+        verdicts.append(
+            txn_totals_of_response is not None
+            and txn_totals_of_response == (challenge.in_total_amount, challenge.out_total_amount)
+        )
+    return verdicts
+
+
 @dataclass
 class Block:
     block_height: int
@@ -78,7 +188,7 @@ class Transaction:
     tx_id: str
     block_height: int
     timestamp: int  # Using int to represent Unix based time
-    fee_satoshi: int
+    fee_satoshi: Optional[int]  # None when the block format doesn't carry it (raw blocks)
     vins: List["VIN"] = field(default_factory=list)
     vouts: List["VOUT"] = field(default_factory=list)
     is_coinbase: bool = False
@@ -100,13 +210,20 @@ class VIN:
     vout_id: int
     script_sig: Optional[str]
     sequence: Optional[int]
+    # spent output, when the block was fetched with getblock verbosity 3
+    address: Optional[str] = None
+    value_satoshi: Optional[int] = None
 
 
 getcontext().prec = 28
 SATOSHI = Decimal("100000000")
 
 
-def parse_block_data(block_data):
+def decimal_amount_to_satoshi(amount) -> int:
+    return int(Decimal(amount) * SATOSHI)
+
+
+def parse_block_data(block_data, amount_to_satoshi=decimal_amount_to_satoshi):
     block_height = block_data["height"]
     block_hash = block_data["hash"]
     block_previous_hash = block_data.get("previousblockhash", "")
@@ -121,10 +238,11 @@ def parse_block_data(block_data):
         difficulty=block_data.get("difficulty", 0),
     )
 
+    derived_addresses = derive_block_addresses(block_data)
+
     for tx_data in block_data["tx"]:
         tx_id = tx_data["txid"]
-        fee = Decimal(tx_data.get("fee", 0))
-        fee_satoshi = int(fee * SATOSHI)
+        fee_satoshi = amount_to_satoshi(tx_data.get("fee", 0))
         tx_timestamp = int(tx_data.get("time", timestamp))
 
         tx = Transaction(
@@ -142,6 +260,13 @@ def parse_block_data(block_data):
                 script_sig=vin_data.get("scriptSig", {}).get("asm", ""),
                 sequence=vin_data.get("sequence", 0),
             )
+            prevout = vin_data.get("prevout")
+            if prevout is not None:
+                vin.value_satoshi = amount_to_satoshi(prevout["value"])
+                vin.address = (
+                    get_script_pub_key_address(prevout["scriptPubKey"], derived_addresses)
+                    or f"unknown-{vin.tx_id}"
+                )
             tx.vins.append(vin)
             tx.is_coinbase = "coinbase" in vin_data
 
@@ -150,28 +275,15 @@ def parse_block_data(block_data):
             if "nonstandard" in script_type or script_type == "nulldata":
                 continue
 
-            value_satoshi = int(Decimal(vout_data["value"]) * SATOSHI)
+            value_satoshi = amount_to_satoshi(vout_data["value"])
             n = vout_data["n"]
             script_pub_key_asm = vout_data["scriptPubKey"].get("asm", "")
 
-            address = vout_data["scriptPubKey"].get("address", "")
+            address = get_script_pub_key_address(vout_data["scriptPubKey"], derived_addresses)
             if not address:
-                addresses = vout_data["scriptPubKey"].get("addresses", [])
-                if addresses:
-                    address = addresses[0]
-                elif "OP_CHECKSIG" in script_pub_key_asm:
-                    pubkey = script_pub_key_asm.split()[0]
-                    address = pubkey_to_address(pubkey)
-                elif "OP_CHECKMULTISIG" in script_pub_key_asm:
-                    pubkeys = script_pub_key_asm.split()[1:-2]
-                    m = int(script_pub_key_asm.split()[0])
-                    redeem_script = construct_redeem_script(pubkeys, m)
-                    hashed_script = hash_redeem_script(redeem_script)
-                    address = create_p2sh_address(hashed_script)
-                else:
-                    raise Exception(
-                        f"Unknown address type: {vout_data['scriptPubKey']}"
-                    )
+                raise Exception(
+                    f"Unknown address type: {vout_data['scriptPubKey']}"
+                )
 
             vout = VOUT(
                 vout_id=n,
@@ -0,0 +1,469 @@
+import hashlib
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import lru_cache
+
+from node_utils import Block, Transaction, VIN, VOUT, derive_address_from_script_pub_key_asm
+from columnar_block import ColumnarBlock, ColumnarBlockBuilder, UNKNOWN_FEE
+from tx_out_table import AddressPool
+
+
+@dataclass
+class RawBlock:
+    # serialized block as returned by `getblock <hash> 0`; the format carries no height
+    block_height: int
+    data: bytes
+
+
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_1 = 0x51
+OP_16 = 0x60
+OP_RETURN = 0x6a
+OP_EQUAL = 0x87
+OP_CHECKSIG = 0xac
+OP_CHECKMULTISIG = 0xae
+
+MAX_SCRIPT_SIZE = 10000
+# null txid and index 0xffffffff
+COINBASE_PREVOUT = bytes(32) + b"\xff\xff\xff\xff"
+MAX_PUBKEYS_PER_MULTISIG = 20
+
+# opcode names as printed by bitcoind's ScriptToAsmStr
+OPCODE_NAMES = ["OP_UNKNOWN"] * 256
+OPCODE_NAMES[0x4f] = "-1"
+OPCODE_NAMES[0x50] = "OP_RESERVED"
+for _opcode in range(OP_1, OP_16 + 1):
+    OPCODE_NAMES[_opcode] = str(_opcode - OP_1 + 1)
+for _opcode, _name in enumerate((
+    "OP_NOP", "OP_VER", "OP_IF", "OP_NOTIF", "OP_VERIF", "OP_VERNOTIF", "OP_ELSE", "OP_ENDIF",
+    "OP_VERIFY", "OP_RETURN", "OP_TOALTSTACK", "OP_FROMALTSTACK", "OP_2DROP", "OP_2DUP", "OP_3DUP",
+    "OP_2OVER", "OP_2ROT", "OP_2SWAP", "OP_IFDUP", "OP_DEPTH", "OP_DROP", "OP_DUP", "OP_NIP", "OP_OVER",
+    "OP_PICK", "OP_ROLL", "OP_ROT", "OP_SWAP", "OP_TUCK", "OP_CAT", "OP_SUBSTR", "OP_LEFT", "OP_RIGHT",
+    "OP_SIZE", "OP_INVERT", "OP_AND", "OP_OR", "OP_XOR", "OP_EQUAL", "OP_EQUALVERIFY", "OP_RESERVED1",
+    "OP_RESERVED2", "OP_1ADD", "OP_1SUB", "OP_2MUL", "OP_2DIV", "OP_NEGATE", "OP_ABS", "OP_NOT",
+    "OP_0NOTEQUAL", "OP_ADD", "OP_SUB", "OP_MUL", "OP_DIV", "OP_MOD", "OP_LSHIFT", "OP_RSHIFT",
+    "OP_BOOLAND", "OP_BOOLOR", "OP_NUMEQUAL", "OP_NUMEQUALVERIFY", "OP_NUMNOTEQUAL", "OP_LESSTHAN",
+    "OP_GREATERTHAN", "OP_LESSTHANOREQUAL", "OP_GREATERTHANOREQUAL", "OP_MIN", "OP_MAX", "OP_WITHIN",
+    "OP_RIPEMD160", "OP_SHA1", "OP_SHA256", "OP_HASH160", "OP_HASH256", "OP_CODESEPARATOR",
+    "OP_CHECKSIG", "OP_CHECKSIGVERIFY", "OP_CHECKMULTISIG", "OP_CHECKMULTISIGVERIFY", "OP_NOP1",
+    "OP_CHECKLOCKTIMEVERIFY", "OP_CHECKSEQUENCEVERIFY", "OP_NOP4", "OP_NOP5", "OP_NOP6", "OP_NOP7",
+    "OP_NOP8", "OP_NOP9", "OP_NOP10", "OP_CHECKSIGADD",
+), start=0x61):
+    OPCODE_NAMES[_opcode] = _name
+OPCODE_NAMES[0xff] = "OP_INVALIDOPCODE"
+
+SIGHASH_TYPE_NAMES = {
+    0x01: "ALL",
+    0x81: "ALL|ANYONECANPAY",
+    0x02: "NONE",
+    0x82: "NONE|ANYONECANPAY",
+    0x03: "SINGLE",
+    0x83: "SINGLE|ANYONECANPAY",
+}
+
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32M_CONST = 0x2bc830a3
+
+
+def double_sha256(data) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+BECH32_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+
+
+def _get_bech32_generator_terms(top: int) -> int:
+    terms = 0
+    for i in range(5):
+        if (top >> i) & 1:
+            terms ^= BECH32_GENERATOR[i]
+    return terms
+
+
+# generator terms folded in for each value of the 5 bits shifted out of the checksum
+BECH32_GENERATOR_TABLE = [_get_bech32_generator_terms(top) for top in range(32)]
+
+
+def _bech32_polymod(values, checksum: int = 1) -> int:
+    for value in values:
+        checksum = ((checksum & 0x1ffffff) << 5 ^ value) ^ BECH32_GENERATOR_TABLE[checksum >> 25]
+    return checksum
+
+
+@lru_cache(maxsize=None)
+def _get_bech32_hrp_checksum(hrp: str) -> int:
+    # checksum state after the expanded human readable part, which is the same for every address
+    return _bech32_polymod([ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp])
+
+
+def encode_segwit_address(witness_version: int, witness_program: bytes, hrp: str = "bc") -> str:
+    # BIP173 bech32 for version 0 programs, BIP350 bech32m for later versions
+    num_bits = len(witness_program) * 8
+    padding = -num_bits % 5
+    num_values = (num_bits + padding) // 5
+    program_value = int.from_bytes(witness_program, "big") << padding
+    data = [witness_version] + [(program_value >> (5 * i)) & 31 for i in range(num_values - 1, -1, -1)]
+
+    const = 1 if witness_version == 0 else BECH32M_CONST
+    polymod = _bech32_polymod(data + [0] * 6, _get_bech32_hrp_checksum(hrp)) ^ const
+    data += [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join([BECH32_CHARSET[value] for value in data])
+
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+# every pair of base58 digits, so that a number is converted two digits per division
+BASE58_DIGIT_PAIRS = [high + low for high in BASE58_ALPHABET for low in BASE58_ALPHABET]
+
+
+def encode_base58_address(version_byte: bytes, payload: bytes) -> str:
+    # Base58Check, same output as base58.b58encode_check
+    data = version_byte + payload
+    data += double_sha256(data)[:4]
+
+    value = int.from_bytes(data, "big")
+    digit_pairs = []
+    while value:
+        value, digit_pair = divmod(value, 3364)
+        digit_pairs.append(BASE58_DIGIT_PAIRS[digit_pair])
+    encoded = "".join(reversed(digit_pairs)).lstrip("1")
+    return "1" * (len(data) - len(data.lstrip(b"\x00"))) + encoded
+
+
+def iter_script_ops(script: bytes):
+    """
+    Yield the (opcode, push data) pairs of a script like CScript::GetOp.
+    A truncated push yields (None, None) and ends the iteration.
+    """
+    offset = 0
+    script_size = len(script)
+    while offset < script_size:
+        opcode = script[offset]
+        offset += 1
+        if opcode > OP_PUSHDATA4:
+            yield opcode, None
+            continue
+
+        if opcode < OP_PUSHDATA1:
+            data_size = opcode
+        else:
+            size_bytes = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}[opcode]
+            if offset + size_bytes > script_size:
+                yield None, None
+                return
+            data_size = int.from_bytes(script[offset : offset + size_bytes], "little")
+            offset += size_bytes
+
+        if offset + data_size > script_size:
+            yield None, None
+            return
+        yield opcode, script[offset : offset + data_size]
+        offset += data_size
+
+
+def decode_script_num(data: bytes) -> int:
+    if not data:
+        return 0
+    result = int.from_bytes(data, "little")
+    if data[-1] & 0x80:
+        return -(result & ~(0x80 << (8 * (len(data) - 1))))
+    return result
+
+
+def is_valid_signature_encoding(signature: bytes) -> bool:
+    # BIP66 strict DER, followed by the sighash type byte
+    signature_size = len(signature)
+    if signature_size < 9 or signature_size > 73:
+        return False
+    if signature[0] != 0x30 or signature[1] != signature_size - 3:
+        return False
+    len_r = signature[3]
+    if 5 + len_r >= signature_size:
+        return False
+    len_s = signature[5 + len_r]
+    if len_r + len_s + 7 != signature_size:
+        return False
+    if signature[2] != 0x02 or len_r == 0 or signature[4] & 0x80:
+        return False
+    if len_r > 1 and signature[4] == 0x00 and not signature[5] & 0x80:
+        return False
+    if signature[len_r + 4] != 0x02 or len_s == 0 or signature[len_r + 6] & 0x80:
+        return False
+    if len_s > 1 and signature[len_r + 6] == 0x00 and not signature[len_r + 7] & 0x80:
+        return False
+    return True
+
+
+def script_to_asm(script: bytes, decode_sighash: bool = False) -> str:
+    """
+    Disassemble a script the way bitcoind reports `asm`: small pushes as numbers, and for
+    scriptSigs (decode_sighash) signatures with their sighash type, e.g. "3045...[ALL]".
+    """
+    decode_sighash = decode_sighash and not (
+        (script and script[0] == OP_RETURN) or len(script) > MAX_SCRIPT_SIZE
+    )
+    tokens = []
+    for opcode, data in iter_script_ops(script):
+        if opcode is None:
+            tokens.append("[error]")
+            break
+        if data is None:
+            tokens.append(OPCODE_NAMES[opcode])
+        elif len(data) <= 4:
+            tokens.append(str(decode_script_num(data)))
+        elif decode_sighash and (data[-1] & 0x7f) in (1, 2, 3) and is_valid_signature_encoding(data):
+            tokens.append(f"{data[:-1].hex()}[{SIGHASH_TYPE_NAMES[data[-1]]}]")
+        else:
+            tokens.append(data.hex())
+    return " ".join(tokens)
+
+
+def _is_pubkey(data) -> bool:
+    # CPubKey::ValidSize
+    if not data:
+        return False
+    return len(data) == {2: 33, 3: 33, 4: 65, 6: 65, 7: 65}.get(data[0], 0)
+
+
+def _get_multisig_number(opcode, data, min_value: int, max_value: int):
+    if OP_1 <= opcode <= OP_16:
+        number = opcode - OP_1 + 1
+    elif opcode == 1 and data[0] > 16:
+        number = data[0]
+    else:
+        return None
+    return number if min_value <= number <= max_value else None
+
+
+def _is_multisig(script: bytes) -> bool:
+    if not script or script[-1] != OP_CHECKMULTISIG:
+        return False
+    ops = list(iter_script_ops(script))
+    if len(ops) < 3 or ops[0][0] is None or ops[-1] != (OP_CHECKMULTISIG, None):
+        return False
+
+    required_sigs = _get_multisig_number(*ops[0], 1, MAX_PUBKEYS_PER_MULTISIG)
+    if required_sigs is None:
+        return False
+    pubkey_ops = ops[1:-2]
+    if not all(_is_pubkey(data) for _, data in pubkey_ops):
+        return False
+    num_keys_op = ops[-2]
+    if num_keys_op[0] is None or _is_pubkey(num_keys_op[1]):
+        return False
+    num_keys = _get_multisig_number(*num_keys_op, required_sigs, MAX_PUBKEYS_PER_MULTISIG)
+    return num_keys == len(pubkey_ops)
+
+
+def classify_script_pub_key(script: bytes):
+    """
+    Returns (type, asm, address) for an output script, with bitcoind's type names.
+    address is None where bitcoind reports none (pubkey, multisig, nulldata, nonstandard).
+    """
+    script_size = len(script)
+
+    if script_size == 25 and script[:3] == b"\x76\xa9\x14" and script[23:] == b"\x88\xac":
+        key_hash = script[3:23]
+        return (
+            "pubkeyhash",
+            f"OP_DUP OP_HASH160 {key_hash.hex()} OP_EQUALVERIFY OP_CHECKSIG",
+            encode_base58_address(b"\x00", key_hash),
+        )
+
+    if script_size == 23 and script[:2] == b"\xa9\x14" and script[22] == OP_EQUAL:
+        script_hash = script[2:22]
+        return "scripthash", f"OP_HASH160 {script_hash.hex()} OP_EQUAL", encode_base58_address(b"\x05", script_hash)
+
+    if (
+        4 <= script_size <= 42
+        and (script[0] == OP_0 or OP_1 <= script[0] <= OP_16)
+        and script[1] + 2 == script_size
+    ):
+        witness_version = 0 if script[0] == OP_0 else script[0] - OP_1 + 1
+        witness_program = script[2:]
+        # pushes of up to 4 bytes are shown as numbers
+        asm = f"{witness_version} {witness_program.hex()}" if len(witness_program) > 4 else script_to_asm(script)
+        if witness_version == 0:
+            if len(witness_program) == 20:
+                return "witness_v0_keyhash", asm, encode_segwit_address(0, witness_program)
+            if len(witness_program) == 32:
+                return "witness_v0_scripthash", asm, encode_segwit_address(0, witness_program)
+            return "nonstandard", asm, None
+        if witness_version == 1 and len(witness_program) == 32:
+            return "witness_v1_taproot", asm, encode_segwit_address(1, witness_program)
+        if witness_version == 1 and witness_program == b"\x4e\x73":
+            return "anchor", asm, encode_segwit_address(1, witness_program)
+        return "witness_unknown", asm, encode_segwit_address(witness_version, witness_program)
+
+    if script_size and script[0] == OP_RETURN:
+        ops = list(iter_script_ops(script[1:]))
+        if all(opcode is not None and opcode <= OP_16 for opcode, _ in ops):
+            return "nulldata", script_to_asm(script), None
+
+    if (
+        (script_size == 35 and script[0] == 33 or script_size == 67 and script[0] == 65)
+        and script[-1] == OP_CHECKSIG
+        and _is_pubkey(script[1:-1])
+    ):
+        return "pubkey", f"{script[1:-1].hex()} OP_CHECKSIG", None
+
+    if _is_multisig(script):
+        return "multisig", script_to_asm(script), None
+    return "nonstandard", script_to_asm(script), None
+
+
+def _read_varint(data, offset: int):
+    prefix = data[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[prefix]
+    return int.from_bytes(data[offset + 1 : offset + 1 + size], "little"), offset + 1 + size
+
+
+def _get_difficulty(bits: int) -> Decimal:
+    # GetDifficulty, printed with 16 significant digits like bitcoind's JSON
+    shift = (bits >> 24) & 0xff
+    difficulty = 0x0000ffff / (bits & 0x00ffffff)
+    while shift < 29:
+        difficulty *= 256.0
+        shift += 1
+    while shift > 29:
+        difficulty /= 256.0
+        shift -= 1
+    return Decimal(format(difficulty, ".16g"))
+
+
+def _read_transaction(data, offset: int):
+    """
+    Read the serialized transaction at offset. Returns (tx_id, is_coinbase, vins, vouts, offset)
+    with vins as (spent tx_id or 0, vout_id, script_sig asm, sequence) and vouts as
+    (vout_id, value_satoshi, script_pub_key asm, address) for the outputs parse_block_data keeps.
+    """
+    tx_start = offset
+    offset += 4
+    is_segwit = data[offset] == 0 and data[offset + 1] == 1
+    if is_segwit:
+        offset += 2
+    body_start = offset
+
+    vins = []
+    num_vins, offset = _read_varint(data, offset)
+    is_coinbase = num_vins == 1 and data[offset : offset + 36] == COINBASE_PREVOUT
+    for _ in range(num_vins):
+        script_size, script_offset = _read_varint(data, offset + 36)
+        sequence = int.from_bytes(data[script_offset + script_size : script_offset + script_size + 4], "little")
+        if is_coinbase:
+            vins.append((0, 0, "", sequence))
+        else:
+            vins.append((
+                data[offset : offset + 32][::-1].hex(),
+                int.from_bytes(data[offset + 32 : offset + 36], "little"),
+                script_to_asm(data[script_offset : script_offset + script_size], decode_sighash=True),
+                sequence,
+            ))
+        offset = script_offset + script_size + 4
+
+    vouts = []
+    num_vouts, offset = _read_varint(data, offset)
+    for n in range(num_vouts):
+        value_satoshi = int.from_bytes(data[offset : offset + 8], "little", signed=True)
+        script_size, offset = _read_varint(data, offset + 8)
+        script_type, script_pub_key_asm, address = classify_script_pub_key(data[offset : offset + script_size])
+        offset += script_size
+        if script_type == "nonstandard" or script_type == "nulldata":
+            continue
+
+        address = address or derive_address_from_script_pub_key_asm(script_pub_key_asm)
+        if not address:
+            raise Exception(f"Unknown address type: {script_type} {script_pub_key_asm}")
+        vouts.append((n, value_satoshi, script_pub_key_asm, address))
+    body_end = offset
+
+    if is_segwit:
+        for _ in range(num_vins):
+            num_items, offset = _read_varint(data, offset)
+            for _ in range(num_items):
+                item_size, offset = _read_varint(data, offset)
+                offset += item_size
+    lock_time_offset = offset
+    offset += 4
+
+    if is_segwit:
+        # the txid commits to the serialization without marker, flag and witnesses
+        tx_hash = double_sha256(
+            b"".join((data[tx_start : tx_start + 4], data[body_start:body_end], data[lock_time_offset:offset]))
+        )
+    else:
+        tx_hash = double_sha256(data[tx_start:offset])
+
+    return tx_hash[::-1].hex(), is_coinbase, vins, vouts, offset
+
+
+def _read_header(raw_block):
+    # (block_hash, timestamp, previous_block_hash, nonce, difficulty)
+    header = raw_block.data[:80]
+    previous_block_hash = header[4:36]
+    return (
+        double_sha256(header)[::-1].hex(),
+        int.from_bytes(header[68:72], "little"),
+        # the genesis block has no previous block
+        previous_block_hash[::-1].hex() if any(previous_block_hash) else "",
+        int.from_bytes(header[76:80], "little"),
+        _get_difficulty(int.from_bytes(header[72:76], "little")),
+    )
+
+
+def parse_raw_block(raw_block) -> Block:
+    """
+    Parse a serialized block (`getblock <hash> 0`) into the same Block that parse_block_data
+    builds from a verbose one, except that fee_satoshi is None (unknown).
+    """
+    block_hash, timestamp, previous_block_hash, nonce, difficulty = _read_header(raw_block)
+    block = Block(
+        block_height=raw_block.block_height,
+        block_hash=block_hash,
+        timestamp=timestamp,
+        previous_block_hash=previous_block_hash,
+        nonce=nonce,
+        difficulty=difficulty,
+    )
+
+    data = raw_block.data
+    num_transactions, offset = _read_varint(data, 80)
+    for _ in range(num_transactions):
+        tx_id, is_coinbase, vins, vouts, offset = _read_transaction(data, offset)
+        # transaction fees need the spent outputs, which a serialized block doesn't carry;
+        # consumers derive them from the resolved prevouts (see build_funds_flow_rows)
+        tx = Transaction(tx_id=tx_id, block_height=raw_block.block_height, timestamp=timestamp, fee_satoshi=None)
+        tx.vins = [
+            VIN(tx_id=prev_tx_id, vin_id=sequence, vout_id=vout_id, script_sig=script_sig, sequence=sequence)
+            for prev_tx_id, vout_id, script_sig, sequence in vins
+        ]
+        tx.vouts = [
+            VOUT(vout_id=n, value_satoshi=value_satoshi, script_pub_key=script_pub_key, is_spent=False, address=address)
+            for n, value_satoshi, script_pub_key, address in vouts
+        ]
+        tx.is_coinbase = is_coinbase
+        block.transactions.append(tx)
+
+    return block
+
+
+def parse_raw_block_columnar(raw_block, address_pool: AddressPool = None, keep_scripts: bool = True) -> ColumnarBlock:
+    # parse_raw_block straight into a ColumnarBlock
+    block_hash, timestamp, previous_block_hash, nonce, difficulty = _read_header(raw_block)
+    builder = ColumnarBlockBuilder(address_pool, keep_scripts)
+
+    data = raw_block.data
+    num_transactions, offset = _read_varint(data, 80)
+    for _ in range(num_transactions):
+        tx_id, is_coinbase, vins, vouts, offset = _read_transaction(data, offset)
+        for prev_tx_id, vout_id, script_sig, sequence in vins:
+            builder.add_vin(prev_tx_id, vout_id, sequence, script_sig)
+        for n, value_satoshi, script_pub_key, address in vouts:
+            builder.add_vout(n, value_satoshi, script_pub_key, address)
+        builder.add_transaction(tx_id, timestamp, UNKNOWN_FEE, is_coinbase)
+
+    return builder.build(raw_block.block_height, block_hash, timestamp, previous_block_hash, nonce, difficulty)
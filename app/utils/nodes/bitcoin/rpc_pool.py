@@ -0,0 +1,300 @@
+import os
+import json
+import decimal
+import http.client
+import threading
+import time
+from contextlib import contextmanager
+
+from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException, EncodeDecimal, USER_AGENT
+
+from setup_logger import setup_logger
+
+
+logger = setup_logger("RpcConnectionPool")
+
+# errors raised by the underlying HTTP connection (as opposed to JSON-RPC errors
+# returned by bitcoind) mean the keep-alive connection has to be replaced
+TRANSPORT_ERRORS = (OSError, http.client.HTTPException)
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_RPC_TIMEOUT = 30
+DEFAULT_HEALTH_CHECK_INTERVAL = 60
+DEFAULT_BATCH_SIZE = 100
+# bitcoind's RPC_INVALID_ADDRESS_OR_KEY, e.g. "No such mempool or blockchain transaction"
+RPC_NOT_FOUND_ERROR_CODE = -5
+
+
+def is_not_found_error(error) -> bool:
+    # error: a JSON-RPC error object from a batch response, or a JSONRPCException
+    error = getattr(error, "error", error)
+    return isinstance(error, dict) and error.get("code") == RPC_NOT_FOUND_ERROR_CODE
+
+
+class PooledConnection:
+    def __init__(self, node_rpc_url: str, timeout: int):
+        self.proxy = AuthServiceProxy(node_rpc_url, timeout=timeout)
+        self.last_used_at = time.time()
+        self.is_broken = False
+
+    def post(self, payload) -> bytes:
+        # AuthServiceProxy.batch_ raises on the first failed call, so batches are
+        # posted directly on the proxy's keep-alive connection
+        url = self.proxy._AuthServiceProxy__url
+        conn = self.proxy._AuthServiceProxy__conn
+        conn.request(
+            'POST',
+            url.path,
+            json.dumps(payload, default=EncodeDecimal),
+            {
+                'Host': url.hostname,
+                'User-Agent': USER_AGENT,
+                'Authorization': self.proxy._AuthServiceProxy__auth_header,
+                'Content-type': 'application/json',
+            },
+        )
+        http_response = conn.getresponse()
+        response_data = http_response.read()
+        if http_response.getheader('Content-Type') != 'application/json':
+            raise JSONRPCException({
+                'code': -342,
+                'message': f"non-JSON HTTP response with '{http_response.status} {http_response.reason}' from server",
+            })
+        return response_data
+
+    def close(self):
+        try:
+            self.proxy._AuthServiceProxy__conn.close()  # Close the connection
+        except Exception:
+            pass
+
+
+class RpcConnectionPool:
+    """
+    Thread-safe pool of keep-alive AuthServiceProxy connections to bitcoind.
+    Each connection is used by one thread at a time; idle connections are
+    health checked before reuse and broken ones are transparently replaced.
+    """
+
+    def __init__(
+        self,
+        node_rpc_url: str,
+        pool_size: int = None,
+        timeout: int = None,
+        health_check_interval: int = None,
+    ):
+        self.node_rpc_url = node_rpc_url
+        self.pool_size = pool_size or int(
+            os.environ.get("BITCOIN_NODE_RPC_POOL_SIZE") or DEFAULT_POOL_SIZE
+        )
+        self.timeout = timeout or int(
+            os.environ.get("BITCOIN_NODE_RPC_TIMEOUT") or DEFAULT_RPC_TIMEOUT
+        )
+        if health_check_interval is None:
+            health_check_interval = int(
+                os.environ.get("BITCOIN_NODE_RPC_HEALTH_CHECK_INTERVAL")
+                or DEFAULT_HEALTH_CHECK_INTERVAL
+            )
+        self.health_check_interval = health_check_interval
+
+        self._idle = []
+        self._num_created = 0
+        self._condition = threading.Condition()
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.reconnects = 0
+        self.health_check_failures = 0
+
+    def _acquire(self) -> PooledConnection:
+        with self._condition:
+            if not self._idle and self._num_created >= self.pool_size:
+                self.waits += 1
+                # a slot freed by _discard_slot lets the waiter open a new connection
+                while not self._idle and self._num_created >= self.pool_size:
+                    self._condition.wait()
+
+            if self._idle:
+                self.hits += 1
+                connection = self._idle.pop()
+            else:
+                self.misses += 1
+                self._num_created += 1
+                connection = None
+
+        try:
+            if connection is None:
+                return PooledConnection(self.node_rpc_url, self.timeout)
+
+            if time.time() - connection.last_used_at > self.health_check_interval:
+                connection = self._check_health(connection)
+            return connection
+        except Exception:
+            # give the slot back, or waiters would block forever once the pool is drained
+            self._discard_slot()
+            raise
+
+    def _discard_slot(self):
+        with self._condition:
+            self._num_created -= 1
+            self._condition.notify()
+
+    def _release(self, connection: PooledConnection):
+        if connection.is_broken:
+            connection.close()
+            try:
+                connection = self._reconnect()
+            except Exception:
+                self._discard_slot()
+                raise
+        connection.last_used_at = time.time()
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def _reconnect(self) -> PooledConnection:
+        with self._condition:
+            self.reconnects += 1
+        return PooledConnection(self.node_rpc_url, self.timeout)
+
+    def _check_health(self, connection: PooledConnection) -> PooledConnection:
+        try:
+            connection.proxy.getblockcount()
+            return connection
+        except Exception as e:
+            # a JSON-RPC error (e.g. -28 warming up, or a 401) also retires the connection
+            logger.warning(f"Replacing stale RPC connection: {e}")
+            with self._condition:
+                self.health_check_failures += 1
+            connection.close()
+            return self._reconnect()
+
+    @contextmanager
+    def _pooled_connection(self):
+        connection = self._acquire()
+        try:
+            yield connection
+        except TRANSPORT_ERRORS:
+            connection.is_broken = True
+            raise
+        finally:
+            self._release(connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow an AuthServiceProxy from the pool. A transport error raised inside
+        the block marks the connection as broken so that it is reopened on release.
+        """
+        with self._pooled_connection() as connection:
+            yield connection.proxy
+
+    def call(self, method: str, *params):
+        """
+        Run a single RPC call on a pooled connection, retrying once on a fresh
+        connection if the keep-alive connection was dropped by the node.
+        """
+        try:
+            with self.connection() as rpc_connection:
+                return getattr(rpc_connection, method)(*params)
+        except TRANSPORT_ERRORS as e:
+            logger.warning(f"RPC connection dropped during {method}, retrying: {e}")
+            with self.connection() as rpc_connection:
+                return getattr(rpc_connection, method)(*params)
+
+    def call_raw(self, method: str, *params) -> bytes:
+        """
+        Run a single RPC call and return the undecoded HTTP response body, for callers
+        that decode large responses themselves (see fast_block_decoder).
+        """
+        payload = {"jsonrpc": "2.0", "method": method, "params": list(params), "id": 0}
+        try:
+            with self._pooled_connection() as connection:
+                return connection.post(payload)
+        except TRANSPORT_ERRORS as e:
+            logger.warning(f"RPC connection dropped during {method}, retrying: {e}")
+            with self._pooled_connection() as connection:
+                return connection.post(payload)
+
+    def batch(self, calls: list) -> list:
+        """
+        Send [(method, params), ...] as a single JSON-RPC batch request.
+        Returns (result, error) tuples in request order so that one failed call
+        (e.g. an unknown txid) does not discard the rest of the batch.
+        """
+        if not calls:
+            return []
+
+        payload = [
+            {"jsonrpc": "2.0", "method": method, "params": list(params), "id": request_id}
+            for request_id, (method, params) in enumerate(calls)
+        ]
+        try:
+            with self._pooled_connection() as connection:
+                response_data = connection.post(payload)
+        except TRANSPORT_ERRORS as e:
+            logger.warning(f"RPC connection dropped during batch, retrying: {e}")
+            with self._pooled_connection() as connection:
+                response_data = connection.post(payload)
+
+        return map_batch_responses(json.loads(response_data, parse_float=decimal.Decimal), len(calls))
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._num_created -= len(idle)
+        for connection in idle:
+            connection.close()
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                "pool_size": self.pool_size,
+                "connections": self._num_created,
+                "idle": len(self._idle),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "reconnects": self.reconnects,
+                "health_check_failures": self.health_check_failures,
+            }
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def map_batch_responses(responses, num_calls: int) -> list:
+    """
+    (result, error) per call of a JSON-RPC batch whose requests were numbered from 0,
+    in request order. Calls without a response keep a missing-result error.
+    """
+    if not isinstance(responses, list):
+        # the whole batch was rejected
+        raise JSONRPCException(responses.get('error') or {'code': -343, 'message': 'invalid batch response'})
+
+    results = [(None, {'code': -343, 'message': 'missing JSON-RPC result'})] * num_calls
+    for response in responses:
+        request_id = response.get('id')
+        # bitcoind answers requests it could not parse with a null id
+        if isinstance(request_id, int) and 0 <= request_id < num_calls:
+            results[request_id] = (response.get('result'), response.get('error'))
+    return results
+
+
+def get_rpc_connection_pool(node_rpc_url: str, pool_size: int = None) -> RpcConnectionPool:
+    # one pool per node url so that every BitcoinNode in the process shares connections
+    with _shared_pools_lock:
+        pool = _shared_pools.get(node_rpc_url)
+        if pool is None:
+            pool = RpcConnectionPool(node_rpc_url, pool_size=pool_size)
+            _shared_pools[node_rpc_url] = pool
+        return pool
+
+
+def reset_rpc_connection_pools():
+    # a forked process inherits the parent's pools, whose sockets it must not share
+    global _shared_pools_lock
+    _shared_pools_lock = threading.Lock()
+    _shared_pools.clear()
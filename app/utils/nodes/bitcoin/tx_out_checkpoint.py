@@ -0,0 +1,69 @@
+import os
+import pickle
+
+
+class TxOutDelta:
+    """
+    Changes applied to the tx_out snapshot by processed blocks: outputs created since
+    the snapshot and snapshot outputs spent since then. Saved as a checkpoint so a
+    restart can replay it on top of the snapshot and resume after last_block_height.
+    """
+
+    def __init__(self):
+        # (txn_id, vout_id) -> (address, amount)
+        self.added = {}
+        # (txn_id, vout_id) of snapshot entries that have been spent
+        self.spent = set()
+        self.last_block_height = None
+        self.last_block_hash = None
+        self.last_checkpoint_block_height = None
+
+    def __len__(self):
+        return len(self.added) + len(self.spent)
+
+    def extends_chain(self, block) -> bool:
+        # whether the block builds on the last applied one; unknown for a bare snapshot
+        return self.last_block_hash is None or block.previous_block_hash == self.last_block_hash
+
+    def apply_block(self, block):
+        """
+        Record the outputs created and spent by a parsed Block, in transaction order.
+        Returns (created, spent) key/value lists for updating the tx_out table.
+        """
+        created = []
+        spent = []
+        for tx in block.transactions:
+            for vin in tx.vins:
+                if vin.tx_id == 0:
+                    continue
+                key = (vin.tx_id, str(vin.vout_id))
+                if self.added.pop(key, None) is None:
+                    self.spent.add(key)
+                spent.append(key)
+
+            for vout in tx.vouts:
+                key = (tx.tx_id, str(vout.vout_id))
+                value = (vout.address, vout.value_satoshi)
+                self.added[key] = value
+                created.append((key, value))
+
+        self.last_block_height = block.block_height
+        self.last_block_hash = block.block_hash
+        return created, spent
+
+    def save(self, path: str):
+        # write the whole delta next to the checkpoint and swap it in atomically
+        self.last_checkpoint_block_height = self.last_block_height
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(self.__dict__, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        delta = cls()
+        with open(path, 'rb') as file:
+            delta.__dict__.update(pickle.load(file))
+        return delta
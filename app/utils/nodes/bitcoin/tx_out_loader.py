@@ -0,0 +1,165 @@
+import os
+import time
+import pickle
+import resource
+import multiprocessing
+from array import array
+
+from setup_logger import setup_logger, logger_extra_data
+
+
+logger = setup_logger("TxOutLoader")
+
+# entries per chunk sent from a loader process to the main process
+DEFAULT_CHUNK_SIZE = 500_000
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _log_file_stats(pickle_path: str, num_entries: int, load_seconds: float, total_seconds: float, worker_peak_rss_mb=None):
+    file_size_mb = os.path.getsize(pickle_path) / (1024 * 1024)
+    stats = {
+        "entries": num_entries,
+        "file_size_mb": round(file_size_mb, 1),
+        "load_seconds": round(load_seconds, 2),
+        "total_seconds": round(total_seconds, 2),
+        "entries_per_second": round(num_entries / total_seconds) if total_seconds > 0 else 0,
+        "mb_per_second": round(file_size_mb / total_seconds, 1) if total_seconds > 0 else 0,
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+    }
+    if worker_peak_rss_mb is not None:
+        stats["worker_peak_rss_mb"] = round(worker_peak_rss_mb, 1)
+    logger.info(f"Loaded tx_out hash table: {pickle_path}", extra=logger_extra_data(**stats))
+
+
+def stream_pickle_into_hash_table(pickle_path: str, hash_table: dict):
+    """
+    Merge a tx_out hash table pickle into `hash_table` shard by shard. Each loaded shard
+    is dropped as soon as it has been merged, and adopted as-is when the target shard
+    is still empty, so a second full copy of the table is never built.
+    """
+    start_time = time.time()
+    with open(pickle_path, 'rb') as file:
+        loaded_hash_table = pickle.load(file)
+    load_seconds = time.time() - start_time
+
+    num_entries = 0
+    for sub_key in list(loaded_hash_table):
+        shard = loaded_hash_table.pop(sub_key)
+        num_entries += len(shard)
+        if hash_table.get(sub_key):
+            hash_table[sub_key].update(shard)
+        else:
+            hash_table[sub_key] = shard
+        del shard
+
+    _log_file_stats(pickle_path, num_entries, load_seconds, time.time() - start_time)
+    return num_entries
+
+
+def _encode_chunk(entries):
+    # tx_out entries as raw column bytes plus the chunk's unique addresses
+    raw_txn_ids = bytearray()
+    vout_ids = array("I")
+    amounts = array("q")
+    address_indexes = array("I")
+    address_index_by_address = {}
+    addresses = []
+
+    for (txn_id, vout_id), (address, amount) in entries:
+        raw_txn_ids += bytes.fromhex(txn_id)
+        vout_ids.append(int(vout_id))
+        amounts.append(int(amount))
+        address_index = address_index_by_address.get(address)
+        if address_index is None:
+            address_index = len(addresses)
+            address_index_by_address[address] = address_index
+            addresses.append(address)
+        address_indexes.append(address_index)
+
+    return bytes(raw_txn_ids), vout_ids.tobytes(), amounts.tobytes(), addresses, address_indexes.tobytes()
+
+
+def _loader_process(task_queue, result_queue, chunk_size: int):
+    # runs in a worker process: unpickle whole files and stream them back in compact chunks
+    while True:
+        pickle_path = task_queue.get()
+        if pickle_path is None:
+            return
+
+        try:
+            start_time = time.time()
+            with open(pickle_path, 'rb') as file:
+                hash_table = pickle.load(file)
+            load_seconds = time.time() - start_time
+
+            num_entries = 0
+            entries = []
+            for sub_key in list(hash_table):
+                entries.extend(hash_table.pop(sub_key).items())
+                if len(entries) >= chunk_size:
+                    num_entries += len(entries)
+                    result_queue.put(("chunk", pickle_path, _encode_chunk(entries)))
+                    entries = []
+            if entries:
+                num_entries += len(entries)
+                result_queue.put(("chunk", pickle_path, _encode_chunk(entries)))
+
+            result_queue.put(("done", pickle_path, (num_entries, load_seconds, get_peak_rss_mb())))
+        except Exception as e:
+            result_queue.put(("error", pickle_path, str(e)))
+
+
+def load_pickles_into_compact_table(pickle_paths, table, max_workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Load tx_out hash table pickles into a CompactTxOutTable using up to `max_workers`
+    processes. Workers unpickle files concurrently and send compact column chunks
+    back through a bounded queue; the main process only stages them and freezes once.
+    """
+    pickle_paths = [path for path in pickle_paths if path]
+    if not pickle_paths:
+        return
+    max_workers = min(max_workers or os.cpu_count() or 1, len(pickle_paths))
+
+    task_queue = multiprocessing.Queue()
+    # bounded so that loaders pause when the main process falls behind
+    result_queue = multiprocessing.Queue(maxsize=max_workers * 2)
+    for pickle_path in pickle_paths:
+        task_queue.put(pickle_path)
+    for _ in range(max_workers):
+        task_queue.put(None)
+
+    workers = [
+        multiprocessing.Process(target=_loader_process, args=(task_queue, result_queue, chunk_size), daemon=True)
+        for _ in range(max_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    start_time = time.time()
+    num_pending_files = len(pickle_paths)
+    try:
+        while num_pending_files:
+            message_type, pickle_path, payload = result_queue.get()
+            if message_type == "chunk":
+                table.stage_columns(*payload)
+            elif message_type == "done":
+                num_entries, load_seconds, worker_peak_rss_mb = payload
+                _log_file_stats(pickle_path, num_entries, load_seconds, time.time() - start_time, worker_peak_rss_mb)
+                num_pending_files -= 1
+            else:
+                raise Exception(f"Failed to load tx_out hash table {pickle_path}: {payload}")
+    finally:
+        for worker in workers:
+            if num_pending_files:
+                worker.terminate()
+            worker.join()
+
+    table.freeze()
+    logger.info(
+        f"Loaded {len(pickle_paths)} tx_out hash tables in {time.time() - start_time} seconds",
+        extra=logger_extra_data(peak_rss_mb=round(get_peak_rss_mb(), 1), **table.get_memory_usage()),
+    )
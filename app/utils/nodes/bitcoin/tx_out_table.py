@@ -0,0 +1,462 @@
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+import numpy as np
+
+
+# address id of an entry that has been evicted but not compacted away yet
+EVICTED_ADDRESS_ID = 0xFFFFFFFF
+# sort live inserts into the overlay once this many are pending
+DEFAULT_MAX_PENDING = 100_000
+# merge the overlay into the columns once it holds this many entries (~48 bytes each)
+DEFAULT_MAX_OVERLAY = 10_000_000
+
+# on-disk index: header, then the columns of CompactTxOutTable one after another
+# (each 8-byte aligned), then address offsets (uint64, num_addresses + 1) and the
+# utf-8 address blob
+INDEX_MAGIC = b"TXOUTIDX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<8sIQQ")
+INDEX_HEADER_SIZE = 64
+
+
+def split_txn_id(txn_id: str):
+    # raw 32-byte txid split into the sorted uint64 prefix and the remaining 24 bytes
+    raw_txn_id = bytes.fromhex(txn_id)
+    return int.from_bytes(raw_txn_id[:8], "big"), raw_txn_id[8:]
+
+
+class AddressPool:
+    """
+    Interned address strings; entries of the tx_out table refer to addresses by id.
+    """
+
+    def __init__(self):
+        self.addresses = []
+        self.address_ids = {}
+
+    def intern(self, address: str) -> int:
+        address_id = self.address_ids.get(address)
+        if address_id is None:
+            address_id = len(self.addresses)
+            self.addresses.append(address)
+            self.address_ids[address] = address_id
+        return address_id
+
+    def __getitem__(self, address_id: int) -> str:
+        return self.addresses[address_id]
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def get_memory_usage(self) -> int:
+        # the strings themselves plus the list and the id dict holding them
+        return (
+            sum(sys.getsizeof(address) for address in self.addresses)
+            + sys.getsizeof(self.addresses)
+            + sys.getsizeof(self.address_ids)
+        )
+
+
+class MappedAddressPool:
+    """
+    Read-only address pool backed by the offsets and blob of a mapped index file.
+    Addresses interned after opening get ids past the mapped ones and live in memory.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: memoryview):
+        self.offsets = offsets
+        self.blob = blob
+        self.num_mapped = len(offsets) - 1
+        self.extra = AddressPool()
+
+    def intern(self, address: str) -> int:
+        return self.num_mapped + self.extra.intern(address)
+
+    def __getitem__(self, address_id: int) -> str:
+        if address_id >= self.num_mapped:
+            return self.extra[address_id - self.num_mapped]
+        start, end = self.offsets[address_id], self.offsets[address_id + 1]
+        return str(self.blob[start:end], "utf-8")
+
+    def __len__(self):
+        return self.num_mapped + len(self.extra)
+
+    def __iter__(self):
+        for address_id in range(len(self)):
+            yield self[address_id]
+
+    def get_memory_usage(self) -> int:
+        # mapped pages are shared through the page cache
+        return self.extra.get_memory_usage()
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _get_index_layout(num_entries: int, num_addresses: int) -> dict:
+    layout = {}
+    offset = INDEX_HEADER_SIZE
+    for name, item_size in (
+        ("prefixes", 8),
+        ("suffixes", 24),
+        ("amounts", 8),
+        ("vout_ids", 4),
+        ("address_ids", 4),
+    ):
+        layout[name] = offset
+        offset = _aligned(offset + item_size * num_entries)
+    layout["address_offsets"] = offset
+    layout["address_blob"] = offset + 8 * (num_addresses + 1)
+    return layout
+
+
+class CompactTxOutTable:
+    """
+    Memory-compact replacement for the 4096 dict shards of the tx_out hash table.
+
+    Entries live in sorted NumPy columns keyed by the raw 32-byte txid (uint64 prefix
+    + 24-byte suffix) and an integer vout, with int64 amounts and interned address
+    ids, which is ~48 bytes per entry plus the unique address strings. Lookups are a
+    binary search on the prefix column.
+
+    Recent inserts are kept in a small dict. Every `max_pending` inserts they are sorted
+    into an in-memory overlay table, so the columns (possibly mapped) are left alone, and
+    only an overlay of `max_overlay` entries is merged into the columns by freeze().
+    With max_pending=0 inserts stay pending until freeze() is called.
+    """
+
+    def __init__(self, address_pool: AddressPool = None, max_pending: int = DEFAULT_MAX_PENDING, max_overlay: int = DEFAULT_MAX_OVERLAY):
+        self.address_pool = address_pool or AddressPool()
+        self.max_pending = max_pending
+        self.max_overlay = max_overlay
+
+        self.prefixes = np.empty(0, dtype=np.uint64)
+        self.suffixes = np.empty((0, 24), dtype=np.uint8)
+        self.vout_ids = np.empty(0, dtype=np.uint32)
+        self.amounts = np.empty(0, dtype=np.int64)
+        self.address_ids = np.empty(0, dtype=np.uint32)
+        self.num_evicted = 0
+
+        # evictions from read-only (mapped) columns, by row index
+        self.evicted_indexes = set()
+        self._mmap = None
+
+        # live inserts, visible immediately: (txn_id, vout_id) -> (address_id, amount)
+        self.pending = {}
+        # sorted CompactTxOutTable of earlier inserts, sharing the address pool; it shadows the columns
+        self.overlay = None
+        # bulk loads, only visible after freeze()
+        self._staged_txn_ids = bytearray()
+        self._staged_vout_ids = array("I")
+        self._staged_amounts = array("q")
+        self._staged_address_ids = array("I")
+
+    def __len__(self):
+        # a re-added (txid, vout) counts once per level it is in until freeze()
+        overlay_length = len(self.overlay) if self.overlay is not None else 0
+        return len(self.prefixes) - self.num_evicted + overlay_length + len(self.pending)
+
+    def __contains__(self, key):
+        return self.get(*key) is not None
+
+    def _find(self, prefix: int, suffix: bytes, vout_id: int) -> int:
+        index = int(np.searchsorted(self.prefixes, np.uint64(prefix), side="left"))
+        while index < len(self.prefixes) and int(self.prefixes[index]) == prefix:
+            if int(self.vout_ids[index]) == vout_id and self.suffixes[index].tobytes() == suffix:
+                return index
+            index += 1
+        return -1
+
+    def get(self, txn_id: str, vout_id):
+        """
+        Same contract as a tx_out hash table lookup: (address, amount) or None.
+        """
+        vout_id = int(vout_id)
+        entry = self.pending.get((txn_id, vout_id))
+        if entry is not None:
+            address_id, amount = entry
+            return self.address_pool[address_id], amount
+
+        prefix, suffix = split_txn_id(txn_id)
+        if self.overlay is not None:
+            tx_out = self.overlay._get_column_entry(prefix, suffix, vout_id)
+            if tx_out is not None:
+                return tx_out
+        return self._get_column_entry(prefix, suffix, vout_id)
+
+    def _get_column_entry(self, prefix: int, suffix: bytes, vout_id: int):
+        index = self._find(prefix, suffix, vout_id)
+        if index < 0:
+            return None
+        address_id = int(self.address_ids[index])
+        if address_id == EVICTED_ADDRESS_ID or index in self.evicted_indexes:
+            return None
+        return self.address_pool[address_id], int(self.amounts[index])
+
+    def add(self, txn_id: str, vout_id, address: str, amount: int):
+        self.pending[(txn_id, int(vout_id))] = (self.address_pool.intern(address), int(amount))
+        if self.max_pending and len(self.pending) >= self.max_pending:
+            self.flush_pending()
+
+    def flush_pending(self):
+        """
+        Sort the pending inserts into the overlay, which only costs a sort of the overlay,
+        and merge the overlay into the columns once it reaches max_overlay entries.
+        """
+        if self.overlay is None:
+            self.overlay = CompactTxOutTable(address_pool=self.address_pool, max_pending=0)
+        # same address pool, so the pending address ids are valid in the overlay
+        self.overlay.pending.update(self.pending)
+        self.pending = {}
+        self.overlay.freeze()
+        if len(self.overlay.prefixes) >= self.max_overlay:
+            self.freeze()
+
+    def remove(self, txn_id: str, vout_id) -> bool:
+        # an output re-added after the snapshot may be in several levels, so all of them are cleared
+        vout_id = int(vout_id)
+        removed = self.pending.pop((txn_id, vout_id), None) is not None
+        prefix, suffix = split_txn_id(txn_id)
+        if self.overlay is not None:
+            removed = self.overlay._remove_column_entry(prefix, suffix, vout_id) or removed
+        return self._remove_column_entry(prefix, suffix, vout_id) or removed
+
+    def _remove_column_entry(self, prefix: int, suffix: bytes, vout_id: int) -> bool:
+        index = self._find(prefix, suffix, vout_id)
+        if index < 0 or self.address_ids[index] == EVICTED_ADDRESS_ID or index in self.evicted_indexes:
+            return False
+        # tombstone, dropped on the next freeze()
+        if self.address_ids.flags.writeable:
+            self.address_ids[index] = EVICTED_ADDRESS_ID
+        else:
+            self.evicted_indexes.add(index)
+        self.num_evicted += 1
+        return True
+
+    def stage(self, txn_id: str, vout_id, address: str, amount: int):
+        # cheap append for bulk loads; call freeze() once the load is complete
+        self._staged_txn_ids += bytes.fromhex(txn_id)
+        self._staged_vout_ids.append(int(vout_id))
+        self._staged_amounts.append(int(amount))
+        self._staged_address_ids.append(self.address_pool.intern(address))
+
+    def stage_columns(self, raw_txn_ids: bytes, vout_ids: bytes, amounts: bytes, addresses: list, address_indexes: bytes):
+        """
+        Bulk append pre-encoded entries (see tx_out_loader). address_indexes point into
+        `addresses`, which only holds the unique addresses of this chunk.
+        """
+        address_ids = np.fromiter(
+            (self.address_pool.intern(address) for address in addresses), dtype=np.uint32, count=len(addresses)
+        )
+        self._staged_txn_ids += raw_txn_ids
+        self._staged_vout_ids.frombytes(vout_ids)
+        self._staged_amounts.frombytes(amounts)
+        self._staged_address_ids.frombytes(address_ids[np.frombuffer(address_indexes, dtype=np.uint32)].tobytes())
+
+    def load_hash_table(self, hash_table: dict, freeze: bool = True):
+        """
+        Bulk load a legacy {sub_key: {(txn_id, vout_id): (address, amount)}} table.
+        Shards are emptied as they are copied so both copies never coexist in full.
+        """
+        for sub_key in list(hash_table):
+            shard = hash_table[sub_key]
+            while shard:
+                (txn_id, vout_id), (address, amount) = shard.popitem()
+                self.stage(txn_id, vout_id, address, amount)
+        if freeze:
+            self.freeze()
+
+    def freeze(self):
+        """
+        Merge staged, overlay and pending entries into the sorted columns and drop evicted
+        ones. Later inserts of the same (txid, vout) win over earlier ones.
+        """
+        overlay = self.overlay
+        if overlay is None:
+            overlay = CompactTxOutTable(address_pool=self.address_pool, max_pending=0)
+
+        staged_txn_ids = np.frombuffer(bytes(self._staged_txn_ids), dtype=np.uint8).reshape(-1, 32)
+        pending_txn_ids = np.frombuffer(
+            b"".join(bytes.fromhex(txn_id) for txn_id, _ in self.pending), dtype=np.uint8
+        ).reshape(-1, 32)
+
+        prefixes = np.concatenate([
+            self.prefixes,
+            staged_txn_ids[:, :8].copy().view(">u8").ravel().astype(np.uint64),
+            overlay.prefixes,
+            pending_txn_ids[:, :8].copy().view(">u8").ravel().astype(np.uint64),
+        ])
+        suffixes = np.concatenate([self.suffixes, staged_txn_ids[:, 8:], overlay.suffixes, pending_txn_ids[:, 8:]])
+        vout_ids = np.concatenate([
+            self.vout_ids,
+            np.frombuffer(self._staged_vout_ids, dtype=np.uint32),
+            overlay.vout_ids,
+            np.fromiter((vout_id for _, vout_id in self.pending), dtype=np.uint32, count=len(self.pending)),
+        ])
+        amounts = np.concatenate([
+            self.amounts,
+            np.frombuffer(self._staged_amounts, dtype=np.int64),
+            overlay.amounts,
+            np.fromiter((amount for _, amount in self.pending.values()), dtype=np.int64, count=len(self.pending)),
+        ])
+        address_ids = self.address_ids
+        if self.evicted_indexes:
+            address_ids = address_ids.copy()
+            address_ids[np.fromiter(self.evicted_indexes, dtype=np.int64)] = EVICTED_ADDRESS_ID
+        address_ids = np.concatenate([
+            address_ids,
+            np.frombuffer(self._staged_address_ids, dtype=np.uint32),
+            overlay.address_ids,
+            np.fromiter((address_id for address_id, _ in self.pending.values()), dtype=np.uint32, count=len(self.pending)),
+        ])
+
+        self.pending = {}
+        self.overlay = None
+        self._staged_txn_ids = bytearray()
+        self._staged_vout_ids = array("I")
+        self._staged_amounts = array("q")
+        self._staged_address_ids = array("I")
+
+        # stable sort, so the newest of duplicated keys stays last in its run
+        suffix_words = np.ascontiguousarray(suffixes).view(">u8")
+        order = np.lexsort((vout_ids, suffix_words[:, 2], suffix_words[:, 1], suffix_words[:, 0], prefixes))
+        prefixes, suffixes, vout_ids = prefixes[order], suffixes[order], vout_ids[order]
+        amounts, address_ids = amounts[order], address_ids[order]
+
+        keep = address_ids != EVICTED_ADDRESS_ID
+        if len(prefixes) > 1:
+            is_last_of_key = np.ones(len(prefixes), dtype=bool)
+            is_last_of_key[:-1] = (
+                (prefixes[:-1] != prefixes[1:])
+                | (vout_ids[:-1] != vout_ids[1:])
+                | (suffixes[:-1] != suffixes[1:]).any(axis=1)
+            )
+            keep &= is_last_of_key
+
+        self.prefixes = prefixes[keep]
+        self.suffixes = np.ascontiguousarray(suffixes[keep])
+        self.vout_ids = vout_ids[keep]
+        self.amounts = amounts[keep]
+        self.address_ids = address_ids[keep]
+        self.num_evicted = 0
+        self.evicted_indexes = set()
+        # the columns now live in memory; a mapped address blob stays referenced by its pool
+        self._mmap = None
+
+    def get_column_bytes(self) -> int:
+        return (
+            self.prefixes.nbytes + self.suffixes.nbytes + self.vout_ids.nbytes
+            + self.amounts.nbytes + self.address_ids.nbytes
+        )
+
+    def get_memory_usage(self) -> dict:
+        """
+        Process memory (columns, overlay, address pool, pending dict) and the size of the
+        mapped index file are reported apart: mapped pages live in the page cache, shared
+        by every process mapping the file, and only become resident as they are read.
+        """
+        num_entries = len(self)
+        column_bytes = self.get_column_bytes()
+        mapped_bytes = 0
+        if self._mmap is not None:
+            # the columns and the address blob are views on the mapping
+            column_bytes = 0
+            mapped_bytes = len(self._mmap)
+        overlay_bytes = self.overlay.get_column_bytes() if self.overlay is not None else 0
+        address_bytes = self.address_pool.get_memory_usage()
+        # dict slots plus, per entry, the key and value tuples, the txid string and three ints
+        pending_bytes = sys.getsizeof(self.pending) + len(self.pending) * (
+            sys.getsizeof((None, None)) * 2 + sys.getsizeof("0" * 64) + sys.getsizeof(2 ** 40) * 3
+        )
+        process_bytes = column_bytes + overlay_bytes + address_bytes + pending_bytes
+        total_bytes = process_bytes + mapped_bytes
+        return {
+            "entries": num_entries,
+            "addresses": len(self.address_pool),
+            "column_bytes": column_bytes,
+            "mapped_bytes": mapped_bytes,
+            "overlay_entries": len(self.overlay.prefixes) if self.overlay is not None else 0,
+            "overlay_bytes": overlay_bytes,
+            "address_bytes": address_bytes,
+            "pending_entries": len(self.pending),
+            "pending_bytes": pending_bytes,
+            "process_bytes": process_bytes,
+            "total_bytes": total_bytes,
+            "bytes_per_entry": total_bytes / num_entries if num_entries else 0,
+        }
+
+    def save(self, path: str):
+        """
+        Write the table as an index file that open_mapped() can map without loading.
+        The file is written next to `path` and moved into place once complete.
+        """
+        if self.pending or self.overlay is not None or self._staged_vout_ids or self.num_evicted:
+            self.freeze()
+
+        num_entries = len(self.prefixes)
+        num_addresses = len(self.address_pool)
+        layout = _get_index_layout(num_entries, num_addresses)
+
+        encoded_lengths = np.fromiter(
+            (len(address.encode("utf-8")) for address in self.address_pool), dtype=np.uint64, count=num_addresses
+        )
+        address_offsets = np.zeros(num_addresses + 1, dtype=np.uint64)
+        np.cumsum(encoded_lengths, out=address_offsets[1:])
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, num_entries, num_addresses).ljust(INDEX_HEADER_SIZE, b"\0"))
+            for name, column in (
+                ("prefixes", self.prefixes.astype("<u8")),
+                ("suffixes", self.suffixes),
+                ("amounts", self.amounts.astype("<i8")),
+                ("vout_ids", self.vout_ids.astype("<u4")),
+                ("address_ids", self.address_ids.astype("<u4")),
+                ("address_offsets", address_offsets.astype("<u8")),
+            ):
+                file.write(b"\0" * (layout[name] - file.tell()))
+                file.write(np.ascontiguousarray(column).tobytes())
+            for address in self.address_pool:
+                file.write(address.encode("utf-8"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open_mapped(cls, path: str):
+        """
+        Map an index file written by save(). Columns are zero-copy views on the
+        mapping, so opening is instant and every process shares the page cache.
+        """
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_entries, num_addresses = INDEX_HEADER.unpack_from(mapping, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise Exception(f"Unsupported tx_out index file: {path}")
+        layout = _get_index_layout(num_entries, num_addresses)
+
+        def column(name, dtype, count):
+            return np.frombuffer(mapping, dtype=dtype, count=count, offset=layout[name])
+
+        address_offsets = column("address_offsets", "<u8", num_addresses + 1)
+        address_blob = memoryview(mapping)[layout["address_blob"]:]
+
+        # inserts go to the overlay; the mapped columns are only copied into memory when
+        # a full overlay is merged into them
+        table = cls(address_pool=MappedAddressPool(address_offsets, address_blob))
+        table.prefixes = column("prefixes", "<u8", num_entries)
+        table.suffixes = column("suffixes", np.uint8, 24 * num_entries).reshape(-1, 24)
+        table.amounts = column("amounts", "<i8", num_entries)
+        table.vout_ids = column("vout_ids", "<u4", num_entries)
+        table.address_ids = column("address_ids", "<u4", num_entries)
+        table._mmap = mapping
+        return table
@@ -1,5 +1,6 @@
 from core.protocol import NETWORK_BITCOIN, NETWORK_ETHEREUM
-from bitcoin.node import BitcoinNode
+from bitcoin.node import BitcoinNode, get_shared_bitcoin_node
+from bitcoin.async_node import AsyncBitcoinNode
 from ethereum.node import EthereumNode
 
 
@@ -15,4 +16,19 @@ class NodeFactory:
         if node_class is None:
             raise ValueError(f"Unsupported network: {network}")
 
-        return node_class()
\ No newline at end of file
+        if node_class is BitcoinNode:
+            # the async node shares it, see create_async_node
+            return get_shared_bitcoin_node()
+        return node_class()
+
+    @classmethod
+    def create_async_node(cls, network: str, node=None):
+        node_class = {
+            NETWORK_BITCOIN: AsyncBitcoinNode,
+        }.get(network)
+
+        if node_class is None:
+            raise ValueError(f"Unsupported network: {network}")
+
+        # wraps `node` (or the process's shared BitcoinNode) instead of loading its own tx_out table
+        return node_class(bitcoin_node=node)
\ No newline at end of file